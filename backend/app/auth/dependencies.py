@@ -1,36 +1,33 @@
 # -*- coding: utf-8 -*-
-from fastapi import Depends, HTTPException, status
-from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi import Depends, HTTPException, Request, status
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.models.database import get_db, User
-from app.auth.service import decode_token, get_user_by_id
+from app.services.user_cache import get_cached_user
 
-security = HTTPBearer()
+# Exceptions construites une seule fois : pas d'__init__ ni de dict headers par requête
+# refusée. with_traceback(None) au raise pour ne pas accumuler les tracebacks.
+_UNAUTHORIZED = HTTPException(
+    status_code=status.HTTP_401_UNAUTHORIZED,
+    detail="Token invalide ou expiré",
+    headers={"WWW-Authenticate": "Bearer"},
+)
+_FORBIDDEN = HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Accès admin requis")
 
 
 async def get_current_user(
-    credentials: HTTPAuthorizationCredentials = Depends(security),
+    request: Request,
     db: AsyncSession = Depends(get_db),
 ) -> User:
-    token = credentials.credentials
-    payload = decode_token(token)
-    if not payload:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Token invalide ou expiré",
-        )
-    user_id = payload.get("sub")
-    if not user_id:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token invalide")
-
-    user = await get_user_by_id(db, user_id)
-    if not user or not user.is_active:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Utilisateur introuvable")
+    # Token déjà validé par JWTAuthenticationMiddleware (401 avant d'arriver ici sinon).
+    # Cache TTL 60s : évite un SELECT users sur chaque requête authentifiée
+    user_id = getattr(request.state, "user_id", None)
+    if not user_id or not (user := await get_cached_user(db, user_id)) or not user.is_active:
+        raise _UNAUTHORIZED.with_traceback(None)
     return user
 
 
 async def get_admin_user(current_user: User = Depends(get_current_user)) -> User:
     if current_user.role != "admin":
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Accès admin requis")
+        raise _FORBIDDEN.with_traceback(None)
     return current_user
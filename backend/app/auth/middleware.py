@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+Middleware ASGI d'authentification JWT.
+
+Valide le bearer token avant le routage FastAPI : un token absent ou invalide est
+rejeté en 401 sans résoudre les dépendances ni ouvrir de session DB. L'id utilisateur
+extrait du token (UUID déjà parsé) est exposé dans request.state.user_id pour get_current_user.
+"""
+from typing import Iterable
+
+from fastapi.responses import ORJSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from app.auth.service import decode_token
+
+
+class JWTAuthenticationMiddleware:
+    def __init__(
+        self,
+        app: ASGIApp,
+        protected_prefix: str = "/api/",
+        exclude_paths: Iterable[str] = (),
+    ) -> None:
+        self.app = app
+        self.protected_prefix = protected_prefix
+        self.exclude_paths = frozenset(exclude_paths)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if (
+            scope["type"] != "http"
+            or scope["method"] == "OPTIONS"  # preflight CORS
+            or not scope["path"].startswith(self.protected_prefix)
+            or scope["path"] in self.exclude_paths
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        token = None
+        for name, value in scope["headers"]:
+            if name == b"authorization":
+                scheme, _, credentials = value.decode("latin-1").partition(" ")
+                if scheme.lower() == "bearer" and credentials:
+                    token = credentials.strip()
+                break
+
+        payload = decode_token(token) if token else None
+        if not payload:
+            response = ORJSONResponse(
+                {"detail": "Token invalide ou expiré"},
+                status_code=401,
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+            await response(scope, receive, send)
+            return
+
+        scope.setdefault("state", {})["user_id"] = payload["sub_uuid"]
+        await self.app(scope, receive, send)
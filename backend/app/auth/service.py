@@ -1,61 +1,166 @@
 # -*- coding: utf-8 -*-
+import asyncio
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
 from typing import Optional
+from uuid import UUID
 
-from jose import JWTError, jwt
-from passlib.context import CryptContext
-from sqlalchemy import select
+import bcrypt
+import jwt
+from sqlalchemy import bindparam, select
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.config import settings
 from app.models.database import User
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Valeurs JWT figées à l'import : lues à chaque requête authentifiée
+_SECRET_KEY = settings.SECRET_KEY
+_ALGORITHM = settings.ALGORITHM
+_ALGORITHMS = [settings.ALGORITHM]
+_ACCESS_TOKEN_EXPIRE = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
 
+# bcrypt coûte ~100ms CPU par appel. La lib native libère le GIL pendant le calcul :
+# un pool de threads suffit pour paralléliser sur tous les cœurs sans bloquer la boucle
+# asyncio. Le sémaphore borne la file d'attente (back-pressure en cas de rafale de
+# logins, ex: brute-force).
+_BCRYPT_WORKERS = os.cpu_count() or 1
+_bcrypt_pool: Optional[ThreadPoolExecutor] = None
+_bcrypt_semaphore = asyncio.Semaphore(_BCRYPT_WORKERS * 2)
 
-def hash_password(password: str) -> str:
-    return pwd_context.hash(password[:72])
 
+def get_bcrypt_pool() -> ThreadPoolExecutor:
+    global _bcrypt_pool
+    if _bcrypt_pool is None:
+        _bcrypt_pool = ThreadPoolExecutor(max_workers=_BCRYPT_WORKERS, thread_name_prefix="bcrypt")
+    return _bcrypt_pool
 
-def verify_password(plain: str, hashed: str) -> bool:
-    return pwd_context.verify(plain[:72], hashed)
+
+def shutdown_bcrypt_pool() -> None:
+    global _bcrypt_pool
+    if _bcrypt_pool is not None:
+        _bcrypt_pool.shutdown(wait=False, cancel_futures=True)
+        _bcrypt_pool = None
+
+
+def _password_bytes(password: str) -> bytes:
+    # bcrypt ne considère que 72 octets — même troncature que passlib (hashs existants valides)
+    return password[:72].encode("utf-8")[:72]
+
+
+def _hash_password_sync(password: str) -> str:
+    return bcrypt.hashpw(_password_bytes(password), bcrypt.gensalt(settings.BCRYPT_ROUNDS)).decode("ascii")
+
+
+def _verify_password_sync(plain: str, hashed: str) -> bool:
+    try:
+        return bcrypt.checkpw(_password_bytes(plain), hashed.encode("ascii"))
+    except ValueError:
+        # Hash mal formé en base
+        return False
+
+
+def password_needs_rehash(hashed: str) -> bool:
+    # Format $2b$<cost>$... — coût différent de BCRYPT_ROUNDS → re-hash au prochain login
+    try:
+        return int(hashed.split("$")[2]) != settings.BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return True
+
+
+async def hash_password(password: str) -> str:
+    async with _bcrypt_semaphore:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(get_bcrypt_pool(), _hash_password_sync, password)
+
+
+async def verify_password(plain: str, hashed: str) -> bool:
+    async with _bcrypt_semaphore:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(get_bcrypt_pool(), _verify_password_sync, plain, hashed)
 
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     to_encode = data.copy()
     # FIX : datetime.now(timezone.utc) — datetime.utcnow() est déprécié en Python 3.12
-    expire = datetime.now(timezone.utc) + (
-        expires_delta or timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
-    )
+    expire = datetime.now(timezone.utc) + (expires_delta or _ACCESS_TOKEN_EXPIRE)
     to_encode["exp"] = expire
-    return jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
+    return jwt.encode(to_encode, _SECRET_KEY, algorithm=_ALGORITHM)
+
+
+# Cache LRU des payloads JWT déjà vérifiés — le même token est présenté à chaque requête
+# de la session, inutile de refaire HMAC + parse JSON. Clé = hash du token (le token
+# brut n'est pas conservé en mémoire), entrée valide jusqu'à l'exp du token.
+_token_cache: "OrderedDict[bytes, dict]" = OrderedDict()
+_TOKEN_CACHE_MAX = 10_000
 
 
 def decode_token(token: str) -> Optional[dict]:
+    key = hashlib.blake2b(token.encode(), digest_size=16).digest()
+    cached = _token_cache.get(key)
+    if cached is not None:
+        if cached.get("exp", 0) > time.time():
+            _token_cache.move_to_end(key)
+            return cached
+        del _token_cache[key]
+
     try:
-        return jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-    except JWTError:
+        payload = jwt.decode(token, _SECRET_KEY, algorithms=_ALGORITHMS)
+        # UUID parsé une seule fois par token, réutilisé à chaque hit du cache
+        payload["sub_uuid"] = UUID(payload["sub"])
+    except (jwt.PyJWTError, KeyError, TypeError, ValueError):
         return None
 
+    _token_cache[key] = payload
+    if len(_token_cache) > _TOKEN_CACHE_MAX:
+        _token_cache.popitem(last=False)
+    return payload
+
+
+# Requêtes construites une seule fois à l'import — évite de reconstruire le Select
+# (et sa clé de cache SQLAlchemy) à chaque requête authentifiée
+_USER_BY_USERNAME_STMT = select(User).where(User.username == bindparam("username"))
+_USER_BY_EMAIL_STMT = select(User).where(User.email == bindparam("email"))
+_USER_BY_ID_STMT = select(User).where(User.id == bindparam("uid"))
+
 
 async def get_user_by_username(db: AsyncSession, username: str) -> Optional[User]:
-    result = await db.execute(select(User).where(User.username == username))
+    result = await db.execute(_USER_BY_USERNAME_STMT, {"username": username})
     return result.scalar_one_or_none()
 
 
 async def get_user_by_email(db: AsyncSession, email: str) -> Optional[User]:
-    result = await db.execute(select(User).where(User.email == email))
+    result = await db.execute(_USER_BY_EMAIL_STMT, {"email": email})
     return result.scalar_one_or_none()
 
 
-async def get_user_by_id(db: AsyncSession, user_id: str) -> Optional[User]:
-    from uuid import UUID
-    result = await db.execute(select(User).where(User.id == UUID(user_id)))
+async def get_user_by_id(db: AsyncSession, user_id: UUID) -> Optional[User]:
+    result = await db.execute(_USER_BY_ID_STMT, {"uid": user_id})
     return result.scalar_one_or_none()
 
 
+# Hash factice vérifié quand l'utilisateur n'existe pas : même coût bcrypt que pour
+# un vrai compte, le temps de réponse ne révèle pas l'existence du username
+_dummy_hash: Optional[str] = None
+
+
+async def get_dummy_hash() -> str:
+    global _dummy_hash
+    if _dummy_hash is None:
+        _dummy_hash = await hash_password("x" * 16)
+    return _dummy_hash
+
+
 async def authenticate_user(db: AsyncSession, username: str, password: str) -> Optional[User]:
     user = await get_user_by_username(db, username)
-    if not user or not verify_password(password, user.hashed_password):
+    hashed = user.hashed_password if user else await get_dummy_hash()
+    ok = await verify_password(password, hashed)
+    if not user or not ok:
         return None
+    # BCRYPT_ROUNDS modifié depuis le hash : on re-hashe au login (commit via get_db)
+    if password_needs_rehash(user.hashed_password):
+        user.hashed_password = await hash_password(password)
     return user
@@ -1,21 +1,29 @@
 # -*- coding: utf-8 -*-
 import asyncio
 import logging
+import re
 import sys
 from contextlib import asynccontextmanager
 
 import httpx
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from slowapi import Limiter, _rate_limit_exceeded_handler
+from fastapi.responses import ORJSONResponse
+from slowapi import _rate_limit_exceeded_handler
 from slowapi.errors import RateLimitExceeded
-from slowapi.util import get_remote_address
 
+from app.auth.middleware import JWTAuthenticationMiddleware
+from app.auth.service import get_bcrypt_pool, get_dummy_hash, shutdown_bcrypt_pool
 from app.config import settings
-from app.models.database import init_db
+from app.models.database import init_db, warm_pool
 from app.routers import admin, auth, chat, documents
+from app.services.docling_service import (
+    get_docling_pool, shutdown_docling_pool, warm_up_docling_pool,
+)
 from app.services.embedding_service import verify_embedding_model
 from app.services.qdrant_service import ensure_collection
+from app.utils.body_limit import ContentLengthLimitMiddleware
+from app.utils.rate_limit import limiter
 
 logging.basicConfig(
     level=logging.DEBUG if settings.DEBUG else logging.INFO,
@@ -23,51 +31,122 @@ logging.basicConfig(
     stream=sys.stdout,
 )
 logger = logging.getLogger(__name__)
-limiter = Limiter(key_func=get_remote_address)
 
 
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    logger.info("Démarrage RAG Local…")
+_INIT_ATTEMPT_TIMEOUT = 30  # secondes — borne chaque tentative Ollama/Qdrant
+_SHUTDOWN_DRAIN_TIMEOUT = 30  # secondes — attente des traitements de documents en cours
 
-    # Client HTTP partagé — réutilise le pool de connexions pour tous les appels Ollama
-    app.state.http_client = httpx.AsyncClient(
-        timeout=httpx.Timeout(connect=10.0, read=60.0, write=30.0, pool=5.0),
-        limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
-    )
 
+async def _init_database() -> None:
     await init_db()
+    await warm_pool()
     logger.info("Base de données initialisée")
 
+
+async def _init_vector_store(http_client: httpx.AsyncClient) -> None:
     # Retry avec backoff exponentiel pour Qdrant/Ollama (peuvent démarrer après le backend)
     for attempt in range(1, 6):
         try:
-            # FIX : on passe le client partagé — pas besoin d'en créer un nouveau
-            dim = await verify_embedding_model(app.state.http_client)
-            await ensure_collection(dim)
+            async with asyncio.timeout(_INIT_ATTEMPT_TIMEOUT):
+                # FIX : on passe le client partagé — pas besoin d'en créer un nouveau
+                dim = await verify_embedding_model(http_client)
+                await ensure_collection(dim)
             logger.info(f"Qdrant prêt (dim={dim})")
             break
         except Exception as e:
             if attempt == 5:
-                logger.error(f"Init Qdrant/Ollama échouée après 5 tentatives : {e}")
+                logger.error(f"Init Qdrant/Ollama échouée après 5 tentatives : {e!r}")
             else:
                 wait = 2 ** attempt
-                logger.warning(f"Init tentative {attempt}/5 échouée : {e}. Retry dans {wait}s…")
+                logger.warning(f"Init tentative {attempt}/5 échouée : {e!r}. Retry dans {wait}s…")
                 await asyncio.sleep(wait)
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    logger.info("Démarrage RAG Local…")
+
+    # Client HTTP partagé — réutilise le pool de connexions pour tous les appels Ollama
+    # Keep-alive long (60s au lieu de 5s) : les connexions restent ouvertes entre deux
+    # lots d'embeddings ou deux questions ; retries=2 sur les échecs de connexion seulement.
+    # Pas de HTTP/2 : Ollama est joint en http:// clair, où httpx ne négocie pas h2.
+    app.state.http_client = httpx.AsyncClient(
+        timeout=httpx.Timeout(connect=10.0, read=60.0, write=30.0, pool=5.0),
+        transport=httpx.AsyncHTTPTransport(
+            retries=2,
+            limits=httpx.Limits(
+                max_connections=100, max_keepalive_connections=50, keepalive_expiry=60.0,
+            ),
+        ),
+    )
+
+    # Pools de processus bcrypt et Docling créés au démarrage (avant tout trafic)
+    # plutôt qu'au premier login / premier upload.
+    get_bcrypt_pool()
+    get_docling_pool()
+
+    # Postgres, Ollama/Qdrant, le hash factice anti-timing (pour que le premier login
+    # inconnu ne paie pas deux bcrypt) et le chargement des modèles Docling dans les
+    # workers sont indépendants : initialisés en parallèle
+    async with asyncio.TaskGroup() as tg:
+        tg.create_task(_init_database())
+        tg.create_task(_init_vector_store(app.state.http_client))
+        tg.create_task(get_dummy_hash())
+        tg.create_task(warm_up_docling_pool())
+
+    # Workers d'ingestion des documents (file bornée)
+    documents.start_ingest_workers(app)
+
     yield
 
+    # Arrêt des workers d'ingestion avant de fermer le client HTTP et les pools ;
+    # au-delà du délai, les traitements restants sont annulés (document → statut error)
+    await documents.stop_ingest_workers(app, timeout=_SHUTDOWN_DRAIN_TIMEOUT)
+
     # Fermeture propre du client HTTP à l'arrêt du serveur
     await app.state.http_client.aclose()
+    shutdown_bcrypt_pool()
+    shutdown_docling_pool()
     logger.info("Arrêt propre.")
 
 
-app = FastAPI(title=settings.APP_NAME, version="1.0.0", lifespan=lifespan)
+# ORJSONResponse : sérialisation Rust (datetime/UUID natifs), nettement plus rapide
+# que json stdlib sur les historiques de conversation et listes de documents
+app = FastAPI(
+    title=settings.APP_NAME,
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
+)
+
+# Upload annoncé (Content-Length) au-delà de MAX_FILE_SIZE : 413 avant réception du corps
+app.add_middleware(
+    ContentLengthLimitMiddleware,
+    max_body_size=settings.MAX_FILE_SIZE,
+    paths=["/api/v1/documents/upload"],
+)
+
+# Auth JWT au niveau ASGI : token invalide → 401 avant routage et sans toucher la DB.
+# Ajouté avant CORS pour que CORS reste le middleware externe (headers sur les 401).
+app.add_middleware(
+    JWTAuthenticationMiddleware,
+    protected_prefix="/api/v1/",
+    exclude_paths=["/api/v1/auth/login", "/api/v1/auth/register"],
+)
+
+# CORS depuis settings — configurable via .env.
+# Origines compilées en une regex ancrée (fullmatch C) plutôt qu'un scan de liste
+# par requête ; "*" conserve le mode allow_all de Starlette.
+if "*" in settings.CORS_ORIGINS:
+    _cors_origins, _cors_origin_regex = ["*"], None
+else:
+    _cors_origins = []
+    _cors_origin_regex = "|".join(re.escape(o) for o in settings.CORS_ORIGINS) or None
 
-# CORS depuis settings — configurable via .env
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=settings.CORS_ORIGINS,
+    allow_origins=_cors_origins,
+    allow_origin_regex=_cors_origin_regex,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
@@ -1,8 +1,9 @@
 # -*- coding: utf-8 -*-
+import asyncio
 import uuid
 from typing import AsyncGenerator
 
-from sqlalchemy import Boolean, Column, DateTime, ForeignKey, Integer, String, Text
+from sqlalchemy import Boolean, Column, DateTime, ForeignKey, Index, Integer, String, Text, inspect, text
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import DeclarativeBase, relationship
@@ -10,12 +11,27 @@ from sqlalchemy.sql import func
 
 from app.config import settings
 
+# echo=False même en DEBUG : le formatage de chaque requête via logging coûte cher.
+# Pour tracer le SQL, activer le logger "sqlalchemy.engine" au niveau INFO.
 engine = create_async_engine(
     settings.DATABASE_URL,
-    echo=settings.DEBUG,
+    echo=False,
     pool_pre_ping=True,
-    pool_size=10,
-    max_overflow=20,
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+    pool_recycle=settings.DB_POOL_RECYCLE,
+    # LIFO : on réutilise toujours les mêmes connexions "chaudes" (cache de prepared
+    # statements asyncpg déjà rempli) ; les connexions en trop expirent via pool_recycle
+    pool_use_lifo=True,
+    # Cache des requêtes compilées par SQLAlchemy (défaut 500)
+    query_cache_size=1200,
+    connect_args={
+        # JIT Postgres inutile (et coûteux en planification) sur nos petites requêtes OLTP
+        "server_settings": {"jit": "off"},
+        "statement_cache_size": 1024,
+        # Cache des prepared statements côté dialecte SQLAlchemy/asyncpg (défaut 100)
+        "prepared_statement_cache_size": 512,
+    },
 )
 
 AsyncSessionLocal = async_sessionmaker(
@@ -31,6 +47,10 @@ class Base(DeclarativeBase):
 
 class User(Base):
     __tablename__ = "users"
+    __table_args__ = (
+        # Liste admin triée par date (pagination keyset created_at, id)
+        Index("ix_users_created", "created_at", "id"),
+    )
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     email = Column(String(255), unique=True, nullable=False, index=True)
@@ -46,18 +66,37 @@ class User(Base):
 
 class Document(Base):
     __tablename__ = "documents"
+    __table_args__ = (
+        # Listes par utilisateur filtrées sur le statut
+        Index("ix_docs_user_status", "user_id", "status"),
+        # Liste des documents triée par date (pagination keyset created_at, id)
+        Index("ix_docs_created", "created_at", "id"),
+        # Index partiel : count des documents prêts (admin /stats)
+        Index("ix_docs_ready", "status", postgresql_where=text("status = 'ready'")),
+        # Détection de doublons à l'upload : un seul document actif par contenu
+        Index(
+            "ix_docs_hash_active", "content_hash",
+            unique=True, postgresql_where=text("status != 'error'"),
+        ),
+        # Doublons des documents antérieurs à content_hash : repli sur le nom d'origine
+        Index(
+            "ix_docs_name_nohash", "original_name",
+            postgresql_where=text("content_hash IS NULL AND status != 'error'"),
+        ),
+    )
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     user_id = Column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
     filename = Column(String(500), nullable=False)
     original_name = Column(String(500), nullable=False)
     file_type = Column(String(20), nullable=False)
-    status = Column(String(20), default="processing")
+    status = Column(String(20), default="processing", index=True)
     chunk_count = Column(Integer, default=0)
     error_message = Column(Text, nullable=True)
     # FIX progression : deux nouvelles colonnes pour le suivi du traitement
     progress = Column(Integer, default=0)                    # 0-100%
     status_detail = Column(String(500), nullable=True)       # message lisible par l'utilisateur
+    content_hash = Column(String(64), nullable=True)         # SHA-256 hex du fichier uploadé
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     owner = relationship("User", back_populates="documents")
@@ -84,6 +123,10 @@ class DocumentImage(Base):
 
 class Conversation(Base):
     __tablename__ = "conversations"
+    __table_args__ = (
+        # Accès d'une conversation filtré par propriétaire (id + user_id dans le WHERE)
+        Index("ix_conv_user_id", "user_id", "id"),
+    )
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     user_id = Column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
@@ -112,9 +155,44 @@ class ChatMessage(Base):
     conversation = relationship("Conversation", back_populates="messages")
 
 
+def _add_missing_columns(sync_conn) -> None:
+    # Pas de migrations Alembic : les colonnes nullables ajoutées au modèle après la
+    # création de la table (ex: content_hash) sont ajoutées au démarrage
+    inspector = inspect(sync_conn)
+    for table in Base.metadata.sorted_tables:
+        existing = {c["name"] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing and column.nullable:
+                col_type = column.type.compile(dialect=sync_conn.dialect)
+                sync_conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {col_type}"))
+
+
+def _create_missing_indexes(sync_conn) -> None:
+    # create_all ne crée les index que pour les tables nouvelles : sur une base
+    # existante, on ajoute ceux qui manquent
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(sync_conn, checkfirst=True)
+
+
 async def init_db() -> None:
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_add_missing_columns)
+        await conn.run_sync(_create_missing_indexes)
+
+
+async def warm_pool() -> None:
+    """
+    Ouvre DB_POOL_SIZE connexions au démarrage pour remplir le pool :
+    les premières requêtes ne paient plus TCP + auth + introspection asyncpg.
+    """
+    conns = [engine.connect() for _ in range(settings.DB_POOL_SIZE)]
+    # Toutes ouvertes en même temps (sinon le pool réutiliserait la même connexion)
+    opened = await asyncio.gather(*(c.start() for c in conns), return_exceptions=True)
+    for conn, res in zip(conns, opened):
+        if not isinstance(res, BaseException):
+            await conn.close()
 
 
 async def get_db() -> AsyncGenerator[AsyncSession, None]:
@@ -1,6 +1,11 @@
 # -*- coding: utf-8 -*-
+from datetime import datetime
+from typing import Optional
+from uuid import UUID
+
 from fastapi import APIRouter, Depends, Query
-from sqlalchemy import func, select
+from fastapi.responses import ORJSONResponse
+from sqlalchemy import func, select, tuple_
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.auth.dependencies import get_admin_user
@@ -17,14 +22,31 @@ async def list_users(
     # FIX : pagination pour éviter de charger toute la table d'un coup
     limit: int = Query(default=50, ge=1, le=200),
     offset: int = Query(default=0, ge=0),
+    # Pagination keyset : (created_at, id) du dernier utilisateur de la page précédente.
+    # Préférable à offset pour les pages profondes (pas de scan des lignes sautées) ;
+    # l'id départage les utilisateurs créés au même instant.
+    before: Optional[datetime] = Query(default=None),
+    before_id: Optional[UUID] = Query(default=None),
 ):
-    result = await db.execute(
-        select(User)
-        .order_by(User.created_at.desc())
+    # Colonnes de UserOut uniquement : pas d'instances ORM ni d'identity map
+    stmt = (
+        select(User.id, User.email, User.username, User.role, User.is_active, User.created_at)
+        .order_by(User.created_at.desc(), User.id.desc())
         .limit(limit)
-        .offset(offset)
     )
-    return result.scalars().all()
+    if before is not None and before_id is not None:
+        stmt = stmt.where(tuple_(User.created_at, User.id) < (before, before_id))
+    elif before is not None:
+        stmt = stmt.where(User.created_at < before)
+    else:
+        stmt = stmt.offset(offset)
+
+    # model_construct : pas de revalidation (types garantis par les colonnes DB).
+    # Réponse renvoyée directement — sinon FastAPI revaliderait chaque ligne contre
+    # response_model, qui reste déclaré pour la doc OpenAPI.
+    result = await db.stream(stmt)
+    users = [UserOut.model_construct(**row._asdict()) async for row in result]
+    return ORJSONResponse([u.model_dump() for u in users])
 
 
 @router.get("/stats")
@@ -32,17 +54,20 @@ async def get_stats(
     db: AsyncSession = Depends(get_db),
     _: User = Depends(get_admin_user),
 ):
-    # FIX : or 0 sur tous les scalaires — func.count/sum peut retourner None
-    user_count  = await db.scalar(select(func.count(User.id))) or 0
-    doc_count   = await db.scalar(select(func.count(Document.id))) or 0
-    ready_docs  = await db.scalar(
-        select(func.count(Document.id)).where(Document.status == "ready")
-    ) or 0
-    total_chunks = await db.scalar(select(func.sum(Document.chunk_count))) or 0
+    # Un seul aller-retour Postgres : les quatre agrégats en sous-requêtes scalaires
+    # FIX : coalesce sur la somme — func.sum retourne NULL sur une table vide
+    row = (await db.execute(select(
+        select(func.count(User.id)).scalar_subquery().label("users"),
+        select(func.count(Document.id)).scalar_subquery().label("docs"),
+        select(func.count(Document.id))
+        .where(Document.status == "ready")
+        .scalar_subquery().label("ready"),
+        select(func.coalesce(func.sum(Document.chunk_count), 0)).scalar_subquery().label("chunks"),
+    ))).one()
 
     return {
-        "total_users":      user_count,
-        "total_documents":  doc_count,
-        "ready_documents":  ready_docs,
-        "total_chunks":     total_chunks,
+        "total_users":      row.users or 0,
+        "total_documents":  row.docs or 0,
+        "ready_documents":  row.ready or 0,
+        "total_chunks":     row.chunks or 0,
     }
@@ -11,6 +11,7 @@ from app.auth.service import (
 )
 from app.models.database import User, get_db
 from app.models.schemas import Token, UserLogin, UserOut, UserRegister
+from app.services.user_cache import invalidate_user
 
 router = APIRouter(prefix="/auth", tags=["auth"])
 logger = logging.getLogger(__name__)
@@ -29,12 +30,13 @@ async def register(data: UserRegister, db: AsyncSession = Depends(get_db)):
     user = User(
         email=data.email,
         username=data.username,
-        hashed_password=hash_password(data.password),
+        hashed_password=await hash_password(data.password),
         role="user",
     )
     db.add(user)
     await db.flush()
     await db.refresh(user)
+    invalidate_user(user.id)
     logger.info(f"Nouvel utilisateur inscrit : {user.username}")
     return user
 
@@ -49,6 +51,8 @@ async def login(data: UserLogin, db: AsyncSession = Depends(get_db)):
             detail="Identifiants incorrects",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    # authenticate_user peut avoir re-hashé le mot de passe : l'instance en cache est périmée
+    invalidate_user(user.id)
     token = create_access_token({"sub": str(user.id), "role": user.role})
     return Token(access_token=token)
 
@@ -1,60 +1,78 @@
 # -*- coding: utf-8 -*-
-import json
+import asyncio
+import io
 import logging
 import time
 from typing import Optional
-from uuid import UUID
+from uuid import UUID, uuid4
 
+import orjson
 from fastapi import APIRouter, Depends, HTTPException, Request
-from fastapi.responses import StreamingResponse
-from sqlalchemy import select
+from sqlalchemy import delete, func, insert, select, update
 from sqlalchemy.ext.asyncio import AsyncSession
-from slowapi import Limiter
-from slowapi.util import get_remote_address
+from sqlalchemy.orm import joinedload
+from sse_starlette.sse import EventSourceResponse
 
 from app.config import settings
 from app.auth.dependencies import get_current_user
 from app.models.database import AsyncSessionLocal, ChatMessage, Conversation, User, get_db
 from app.models.schemas import ChatMessageRequest, ConversationDetail, ConversationOut
 from app.services.rag_service import list_available_models, stream_rag_response
+from app.utils.rate_limit import limiter
 
 router = APIRouter(prefix="/chat", tags=["chat"])
 logger = logging.getLogger(__name__)
-limiter = Limiter(key_func=get_remote_address)
 
-# FIX cache modèles : structure avec timestamp pour invalidation
-_models_cache: dict = {"data": None, "ts": 0.0}
+# FIX cache modèles : données + date d'expiration (horloge monotone) en globals de module
+_models_cache_data: Optional[list] = None
+_models_cache_exp: float = 0.0
+_models_refresh: Optional[asyncio.Task] = None
 _MODELS_CACHE_TTL = 30  # secondes
+_MODELS_STALE_TTL = 60  # secondes — liste expirée encore servie pendant le rafraîchissement
 
 
-async def _get_available_models(http_client) -> list:
+async def _refresh_models(http_client) -> list:
     """
     FIX : si la liste retournée est vide (Ollama redémarré, modèles rechargés),
     on invalide le cache immédiatement au lieu d'attendre le TTL.
     Évite de retourner des modèles qui n'existent plus après un redémarrage Ollama.
     """
-    now = time.time()
-    cached = _models_cache["data"]
-    cache_valid = cached is not None and (now - _models_cache["ts"]) < _MODELS_CACHE_TTL
-
-    if cache_valid:
-        return cached
-
+    global _models_cache_data, _models_cache_exp
     models = await list_available_models(http_client)
 
     # FIX : on ne met en cache que si la liste n'est pas vide
     # Si Ollama vient de redémarrer et n'a pas encore ses modèles, on ne cache pas
     if models:
-        _models_cache["data"] = models
-        _models_cache["ts"] = now
+        _models_cache_data = models
+        _models_cache_exp = time.monotonic() + _MODELS_CACHE_TTL
     else:
         # Invalidation du cache — forcera un nouveau fetch au prochain appel
-        _models_cache["data"] = None
-        _models_cache["ts"] = 0.0
+        _models_cache_data = None
+        _models_cache_exp = 0.0
 
     return models
 
 
+async def _get_available_models(http_client) -> list:
+    """
+    Stale-while-revalidate : une liste expirée depuis moins de _MODELS_STALE_TTL est
+    renvoyée tout de suite pendant qu'un seul appel /api/tags la rafraîchit en tâche de fond.
+    Les requêtes concurrentes partagent ce même appel au lieu d'en lancer un chacune.
+    """
+    global _models_refresh
+    now = time.monotonic()
+    if now < _models_cache_exp:
+        return _models_cache_data
+
+    if _models_refresh is None or _models_refresh.done():
+        _models_refresh = asyncio.create_task(_refresh_models(http_client))
+
+    if _models_cache_data is not None and now < _models_cache_exp + _MODELS_STALE_TTL:
+        return _models_cache_data
+    # shield : l'annulation d'une requête cliente n'annule pas le fetch partagé
+    return await asyncio.shield(_models_refresh)
+
+
 @router.post("/stream")
 @limiter.limit(f"{settings.RATE_LIMIT_PER_MINUTE}/minute")
 async def chat_stream(
@@ -69,41 +87,53 @@ async def chat_stream(
 
     history = []
     conversation_id = message.conversation_id
-
-    async with AsyncSessionLocal() as db:
-        if conversation_id:
-            conv = await db.get(Conversation, UUID(conversation_id))
-            if not conv or str(conv.user_id) != str(current_user.id):
+    # UUID parsé une seule fois pour toute la requête (lookup, historique, inserts)
+    conv_uuid = None
+    if conversation_id:
+        try:
+            conv_uuid = UUID(conversation_id)
+        except ValueError:
+            raise HTTPException(404, "Conversation introuvable")
+
+    # Conversation (si nouvelle) + message utilisateur : une seule transaction, un seul commit
+    async with AsyncSessionLocal() as db, db.begin():
+        if conv_uuid:
+            # Propriétaire vérifié dans le WHERE (index user_id, id) — pas d'hydratation
+            owned = await db.scalar(
+                select(Conversation.id)
+                .where(Conversation.id == conv_uuid, Conversation.user_id == current_user.id)
+            )
+            if owned is None:
                 raise HTTPException(404, "Conversation introuvable")
             result = await db.execute(
                 select(ChatMessage)
-                .where(ChatMessage.conversation_id == UUID(conversation_id))
+                .where(ChatMessage.conversation_id == conv_uuid)
                 .order_by(ChatMessage.created_at)
             )
             msgs = result.scalars().all()
             history = [{"role": m.role, "content": m.content} for m in msgs]
         else:
+            # id généré côté Python : pas de flush + refresh pour le récupérer
             title = message.question[:60] + ("…" if len(message.question) > 60 else "")
-            conv = Conversation(user_id=current_user.id, title=title)
-            db.add(conv)
-            await db.flush()
-            await db.refresh(conv)
-            conversation_id = str(conv.id)
-
-        user_msg = ChatMessage(
-            conversation_id=UUID(conversation_id),
+            conv_uuid = uuid4()
+            db.add(Conversation(id=conv_uuid, user_id=current_user.id, title=title))
+            conversation_id = str(conv_uuid)
+
+        db.add(ChatMessage(
+            conversation_id=conv_uuid,
             role="user",
             content=message.question
-        )
-        db.add(user_msg)
-        await db.commit()
+        ))
 
-    full_response = []
+    # Réponse accumulée dans un tampon unique plutôt qu'une liste de petits str
+    full_response = io.StringIO()
 
     async def event_generator():
-        yield f"data: {json.dumps({'type': 'conversation_id', 'conversation_id': conversation_id})}\n\n"
+        # Méthode liée une fois : la boucle par token ne fait plus que des LOAD_FAST
+        write_token = full_response.write
+        yield b"data: " + orjson.dumps({"type": "conversation_id", "conversation_id": conversation_id}) + b"\n\n"
 
-        async for chunk in stream_rag_response(
+        async for kind, token, frame in stream_rag_response(
             question=message.question,
             user_id=str(current_user.id),
             model=message.model,
@@ -118,32 +148,31 @@ async def chat_stream(
             system_prompt=message.system_prompt,
             skip_rag=message.skip_rag,
         ):
-            try:
-                data = json.loads(chunk.removeprefix("data: ").strip())
-                if data.get("type") == "token":
-                    full_response.append(data.get("token", ""))
-                elif data.get("type") == "done" and full_response:
-                    async with AsyncSessionLocal() as db:
-                        assistant_msg = ChatMessage(
-                            conversation_id=UUID(conversation_id),
+            # Type d'événement fourni par le service : pas de json.loads par token
+            if kind == "token":
+                write_token(token)
+            elif kind == "done" and full_response.tell():
+                try:
+                    # Réponse + updated_at de la conversation dans la même transaction
+                    async with AsyncSessionLocal() as db, db.begin():
+                        await db.execute(insert(ChatMessage).values(
+                            conversation_id=conv_uuid,
                             role="assistant",
-                            content="".join(full_response),
+                            content=full_response.getvalue(),
+                        ))
+                        await db.execute(
+                            update(Conversation)
+                            .where(Conversation.id == conv_uuid)
+                            .values(updated_at=func.now())
                         )
-                        db.add(assistant_msg)
-                        await db.commit()
-            except Exception:
-                pass
-            yield chunk
-
-    return StreamingResponse(
-        event_generator(),
-        media_type="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "X-Accel-Buffering": "no",
-            "Connection": "keep-alive",
-        }
-    )
+                except Exception as e:
+                    logger.error(f"Sauvegarde de la réponse impossible ({conversation_id}) : {e}")
+            # Trames déjà encodées par stream_rag_response : transmises telles quelles
+            yield frame
+
+    # EventSourceResponse pose Cache-Control / Connection / X-Accel-Buffering et envoie
+    # un ping toutes les 15s (évite les timeouts proxy pendant les longues générations)
+    return EventSourceResponse(event_generator(), ping=15, sep="\n")
 
 
 @router.get("/conversations", response_model=list[ConversationOut])
@@ -161,38 +190,36 @@ async def list_conversations(
 
 @router.get("/conversations/{conversation_id}", response_model=ConversationDetail)
 async def get_conversation(
-    conversation_id: str,
+    conversation_id: UUID,
     current_user: User = Depends(get_current_user),
     db: AsyncSession = Depends(get_db)
 ):
-    conv = await db.get(Conversation, UUID(conversation_id))
-    if not conv or str(conv.user_id) != str(current_user.id):
-        raise HTTPException(404, "Conversation introuvable")
+    # Conversation + messages en une seule requête (LEFT OUTER JOIN, tri par created_at
+    # défini sur la relation) au lieu de deux SELECT successifs
     result = await db.execute(
-        select(ChatMessage)
-        .where(ChatMessage.conversation_id == UUID(conversation_id))
-        .order_by(ChatMessage.created_at)
+        select(Conversation)
+        .options(joinedload(Conversation.messages))
+        .where(Conversation.id == conversation_id, Conversation.user_id == current_user.id)
     )
-    messages = result.scalars().all()
-    return {
-        "id": conv.id,
-        "title": conv.title,
-        "created_at": conv.created_at,
-        "updated_at": conv.updated_at,
-        "messages": messages,
-    }
+    conv = result.unique().scalar_one_or_none()
+    if not conv:
+        raise HTTPException(404, "Conversation introuvable")
+    return conv
 
 
 @router.delete("/conversations/{conversation_id}", status_code=204)
 async def delete_conversation(
-    conversation_id: str,
+    conversation_id: UUID,
     current_user: User = Depends(get_current_user),
     db: AsyncSession = Depends(get_db)
 ):
-    conv = await db.get(Conversation, UUID(conversation_id))
-    if not conv or str(conv.user_id) != str(current_user.id):
+    # DELETE filtré sur le propriétaire ; les messages partent via ON DELETE CASCADE
+    result = await db.execute(
+        delete(Conversation)
+        .where(Conversation.id == conversation_id, Conversation.user_id == current_user.id)
+    )
+    if result.rowcount == 0:
         raise HTTPException(404, "Conversation introuvable")
-    await db.delete(conv)
     await db.commit()
 
 
@@ -3,12 +3,21 @@ import asyncio
 import hashlib
 import logging
 import os
+import re
+from collections import defaultdict
+from datetime import datetime
 from pathlib import Path
+from typing import BinaryIO, Dict, Optional, Tuple
 from uuid import UUID, uuid4
 
-from fastapi import APIRouter, BackgroundTasks, Depends, File, HTTPException, Request, UploadFile
-from fastapi.responses import FileResponse
-from sqlalchemy import select
+import httpx
+from fastapi import APIRouter, Depends, File, HTTPException, Query, Request, UploadFile
+from fastapi.responses import FileResponse, ORJSONResponse, Response
+from sqlalchemy import (
+    Integer, Text, and_, column, delete, insert, or_, select, tuple_, update, values,
+)
+from sqlalchemy.dialects.postgresql import UUID as PG_UUID
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.config import settings
@@ -17,186 +26,462 @@ from app.models.database import AsyncSessionLocal, Document, DocumentImage, User
 from app.models.schemas import DocumentOut
 from app.services.docling_service import convert_document, IMAGES_DIR
 from app.services.embedding_service import get_embeddings
-from app.services.qdrant_service import delete_document_chunks, ensure_collection, upsert_chunks
+from app.services.qdrant_service import (
+    delete_document_chunks, delete_documents_chunks, ensure_collection, upsert_chunks,
+)
 
 router = APIRouter(prefix="/documents", tags=["documents"])
 logger = logging.getLogger(__name__)
 
 _DOCLING_TIMEOUT = 20 * 60  # 20 minutes
+_UPLOAD_CHUNK_SIZE = 64 * 1024
+_INDEX_BATCH_SIZE = 64  # chunks par lot embeddings → Qdrant
+_SAFE_FILENAME = re.compile(r"[A-Za-z0-9][A-Za-z0-9._-]{0,254}").fullmatch
+_IMAGES_ROOT = os.path.realpath(IMAGES_DIR) + os.sep
+_PROGRESS_FLUSH_INTERVAL = 0.5  # secondes
+
+# Dernière progression connue par document, écrite en base par _progress_flusher
+# (un seul UPDATE pour tous les documents en cours au lieu d'une session par étape)
+_progress_buffer: Dict[UUID, Tuple[int, str]] = {}
+# État DocumentOut des documents en cours de traitement dans ce processus : le statut
+# sondé par le frontend est servi depuis la mémoire, Postgres ne sert qu'aux états finaux
+_live_documents: Dict[UUID, dict] = {}
+
+# Calculés une fois au chargement : lookup O(1) et messages d'erreur sans tri par requête
+_ALLOWED_EXTENSIONS = frozenset(e.lower().lstrip(".") for e in settings.ALLOWED_EXTENSIONS)
+_ALLOWED_EXTENSIONS_MSG = ", ".join(sorted(_ALLOWED_EXTENSIONS))
+_MAX_FILE_SIZE_MB = settings.MAX_FILE_SIZE // 1024 // 1024
+
+# Colonnes exposées par DocumentOut (listes et statut lus sans hydrater d'objets ORM)
+_DOCUMENT_OUT_COLUMNS = (
+    Document.id, Document.filename, Document.original_name, Document.file_type,
+    Document.status, Document.chunk_count, Document.error_message,
+    Document.progress, Document.status_detail, Document.created_at,
+)
+
+_INGEST_FULL_MESSAGE = "Trop de documents en attente de traitement. Réessayez dans quelques minutes."
 
 
 @router.post("/upload", response_model=DocumentOut, status_code=202)
 async def upload_document(
     request: Request,
-    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_user),
 ):
     suffix = Path(file.filename).suffix.lower()
     suffix_clean = suffix.lstrip(".")
-    if suffix_clean not in settings.ALLOWED_EXTENSIONS:
-        raise HTTPException(
-            400,
-            f"Format non supporté : '{suffix}'. Acceptés : {', '.join(sorted(settings.ALLOWED_EXTENSIONS))}"
-        )
-
-    content = await file.read()
-    if len(content) > settings.MAX_FILE_SIZE:
-        raise HTTPException(
-            413,
-            f"Fichier trop volumineux ({len(content)//1024//1024} MB). "
-            f"Maximum : {settings.MAX_FILE_SIZE//1024//1024} MB"
-        )
-
-    # Vérification doublon : même nom ET même contenu (hash SHA256)
-    content_hash = hashlib.sha256(content).hexdigest()
-    existing = await db.execute(
-        select(Document).where(
-            Document.original_name == file.filename,
+    if suffix_clean not in _ALLOWED_EXTENSIONS:
+        raise HTTPException(400, f"Format non supporté : '{suffix}'. Acceptés : {_ALLOWED_EXTENSIONS_MSG}")
+    # File d'ingestion pleine : refus immédiat, avant de lire le corps de la requête
+    ingest_queue: asyncio.Queue = request.app.state.ingest_queue
+    if ingest_queue.full():
+        raise HTTPException(503, _INGEST_FULL_MESSAGE)
+
+    # Upload lu par blocs : hash SHA-256 et contrôle de taille au fil de l'eau, contenu
+    # écrit directement dans UPLOAD_DIR. La tâche de fond reçoit le chemin (Docling lit
+    # le fichier lui-même) : jamais le fichier entier en mémoire, ni ici ni en file d'attente.
+    # Copie complète dans un seul thread : open/read/write bloquants hors de la boucle
+    stored_name = f"{uuid4()}{suffix}"
+    upload_path = os.path.join(settings.UPLOAD_DIR, stored_name)
+    try:
+        content_hash = await asyncio.to_thread(_store_upload_sync, file.file, upload_path)
+    except BaseException:
+        _remove_upload(upload_path)
+        raise
+
+    # Vérification doublon sur le contenu (hash SHA256) : sonde de l'index
+    # ix_docs_hash_active, une seule colonne lue. Documents indexés avant l'ajout de
+    # content_hash (colonne NULL) : repli sur le nom d'origine (index ix_docs_name_nohash)
+    existing_name = await db.scalar(
+        select(Document.original_name)
+        .where(
             Document.status != "error",
+            or_(
+                Document.content_hash == content_hash,
+                and_(Document.content_hash.is_(None), Document.original_name == file.filename),
+            ),
         )
+        .limit(1)
     )
-    existing_doc = existing.scalars().first()
-    if existing_doc:
-        # Vérifie le hash si disponible, sinon rejette sur le nom seul
-        if not hasattr(existing_doc, 'content_hash') or existing_doc.content_hash == content_hash:
-            raise HTTPException(
-                409,
-                f"Ce document existe déjà : '{file.filename}' est déjà indexé dans la base."
-            )
+    if existing_name is not None:
+        _remove_upload(upload_path)
+        raise HTTPException(
+            409,
+            f"Ce document existe déjà : '{existing_name}' est déjà indexé dans la base."
+        )
 
     doc = Document(
         user_id=current_user.id,
-        filename=f"{uuid4()}{suffix}",
+        filename=stored_name,
         original_name=file.filename,
         file_type=suffix_clean,
         status="processing",
         progress=0,
         status_detail="En attente de traitement",
+        content_hash=content_hash,
     )
     db.add(doc)
-    await db.commit()
+    try:
+        await db.commit()
+    except IntegrityError:
+        # Upload concurrent du même contenu : l'index unique a tranché
+        await db.rollback()
+        _remove_upload(upload_path)
+        raise HTTPException(
+            409,
+            f"Ce document existe déjà : '{file.filename}' est déjà indexé dans la base."
+        )
     await db.refresh(doc)
+    _live_documents[doc.id] = DocumentOut.model_validate(doc).model_dump()
 
-    http_client = request.app.state.http_client
-    background_tasks.add_task(
-        _process_document,
-        file_bytes=content,
-        filename=file.filename,
-        document_id=str(doc.id),
-        user_id=str(current_user.id),
-        http_client=http_client,
-    )
+    # Traitement confié aux workers d'ingestion (file bornée, démarrés dans le lifespan)
+    try:
+        ingest_queue.put_nowait({
+            "upload_path": upload_path,
+            "filename": file.filename,
+            "document_id": doc.id,
+            "user_id": str(current_user.id),
+            "http_client": request.app.state.http_client,
+        })
+    except asyncio.QueueFull:
+        # File remplie entre la vérification et le commit : le document ne sera pas traité
+        await _set_error(doc.id, _INGEST_FULL_MESSAGE)
+        _remove_upload(upload_path)
+        raise HTTPException(503, _INGEST_FULL_MESSAGE)
     return doc
 
 
-async def _update_progress(document_id: str, progress: int, detail: str) -> None:
+def start_ingest_workers(app) -> None:
+    """File d'ingestion bornée + DOCLING_CONCURRENCY workers persistants."""
+    queue: asyncio.Queue = asyncio.Queue(maxsize=settings.INGEST_QUEUE_SIZE)
+    app.state.ingest_queue = queue
+    # Arrêt signalé hors de la file (bornée : pas de place garantie pour des marqueurs)
+    app.state.ingest_stopping = asyncio.Event()
+    app.state.ingest_busy = set()
+    app.state.ingest_workers = [
+        asyncio.create_task(
+            _ingest_worker(queue, app.state.ingest_stopping, app.state.ingest_busy),
+            name=f"ingest-worker-{i}",
+        )
+        for i in range(settings.DOCLING_CONCURRENCY)
+    ]
+    app.state.progress_flusher = asyncio.create_task(_progress_flusher(), name="progress-flusher")
+
+
+async def stop_ingest_workers(app, timeout: float) -> None:
+    """
+    Arrêt : les documents encore en file passent en erreur, les traitements en cours ont
+    `timeout` secondes pour finir avant annulation (le document passe alors en erreur).
+    """
+    queue: asyncio.Queue = app.state.ingest_queue
+    workers = app.state.ingest_workers
+    busy = app.state.ingest_busy
+    # Chaque worker s'arrête après son document en cours ; ceux qui attendent dans
+    # queue.get() sont annulés directement (un job non encore retiré reste en file)
+    app.state.ingest_stopping.set()
+    idle = [task for task in workers if task not in busy]
+    for task in idle:
+        task.cancel()
+    await asyncio.gather(*idle, return_exceptions=True)
+    while not queue.empty():
+        job = queue.get_nowait()
+        queue.task_done()
+        await _set_error(job["document_id"], "Traitement interrompu par l'arrêt du serveur. Veuillez réimporter le fichier.")
+        _remove_upload(job["upload_path"])
+    active = [task for task in workers if not task.done()]
+    if active:
+        _, pending = await asyncio.wait(active, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            logger.warning(f"{len(pending)} traitement(s) annulé(s) à l'arrêt")
+    await asyncio.gather(*workers, return_exceptions=True)
+    app.state.progress_flusher.cancel()
+    await asyncio.gather(app.state.progress_flusher, return_exceptions=True)
+
+
+async def _ingest_worker(queue: asyncio.Queue, stopping: asyncio.Event, busy: set) -> None:
+    task = asyncio.current_task()
+    while not stopping.is_set():
+        job = await queue.get()
+        # Aucun await entre get() et l'ajout : un worker hors de busy est forcément inactif
+        busy.add(task)
+        try:
+            await _process_document(**job)
+        except Exception as e:
+            logger.error(f"Worker d'ingestion : erreur inattendue : {e}", exc_info=True)
+        finally:
+            busy.discard(task)
+            queue.task_done()
+
+
+def _store_upload_sync(src: BinaryIO, path: str) -> str:
+    """Copie le fichier reçu (déjà spoolé par Starlette) vers path ; renvoie son SHA-256."""
+    # Créé à la demande (comme IMAGES_DIR) plutôt qu'à l'import du module
+    os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
+    hasher = hashlib.sha256()
+    size = 0
+    with open(path, "wb") as out:
+        while chunk := src.read(_UPLOAD_CHUNK_SIZE):
+            size += len(chunk)
+            if size > settings.MAX_FILE_SIZE:
+                raise HTTPException(413, f"Fichier trop volumineux. Maximum : {_MAX_FILE_SIZE_MB} MB")
+            hasher.update(chunk)
+            out.write(chunk)
+    return hasher.hexdigest()
+
+
+def _remove_upload(path: str) -> None:
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning(f"Suppression du fichier uploadé impossible ({path}) : {e}")
+
+
+async def _update_progress(document_id: UUID, progress: int, detail: str) -> None:
+    # Mémoire uniquement : les étapes rapprochées d'un même document fusionnent
+    _progress_buffer[document_id] = (progress, detail)
+    live = _live_documents.get(document_id)
+    if live is not None:
+        live["progress"] = progress
+        live["status_detail"] = detail
+
+
+async def _flush_progress() -> None:
+    if not _progress_buffer:
+        return
+    pending = list(_progress_buffer.items())
+    _progress_buffer.clear()
+    rows = values(
+        column("id", PG_UUID(as_uuid=True)),
+        column("progress", Integer),
+        column("detail", Text),
+        name="progress_rows",
+    ).data([(doc_id, progress, detail) for doc_id, (progress, detail) in pending])
     try:
         async with AsyncSessionLocal() as db:
-            doc = await db.get(Document, UUID(document_id))
-            if doc:
-                doc.progress = progress
-                doc.status_detail = detail
-                await db.commit()
+            # status = 'processing' : une progression en retard n'écrase jamais ready/error
+            await db.execute(
+                update(Document)
+                .where(Document.id == rows.c.id, Document.status == "processing")
+                .values(progress=rows.c.progress, status_detail=rows.c.detail)
+                .execution_options(synchronize_session=False)
+            )
+            await db.commit()
     except Exception as e:
-        logger.warning(f"[{document_id}] Impossible de mettre à jour la progression : {e}")
+        logger.warning(f"Impossible de mettre à jour la progression ({len(pending)} documents) : {e}")
+
+
+async def _progress_flusher() -> None:
+    while True:
+        await asyncio.sleep(_PROGRESS_FLUSH_INTERVAL)
+        await _flush_progress()
 
 
 async def _process_document(
-    file_bytes: bytes,
+    upload_path: str,
     filename: str,
-    document_id: str,
+    document_id: UUID,
     user_id: str,
-    http_client=None,
+    http_client: httpx.AsyncClient,
 ) -> None:
     try:
-        await asyncio.wait_for(
-            _run_pipeline(file_bytes, filename, document_id, user_id, http_client),
-            timeout=_DOCLING_TIMEOUT,
-        )
-    except asyncio.TimeoutError:
-        logger.error(f"[{document_id}] Timeout après {_DOCLING_TIMEOUT//60} minutes")
-        await _set_error(document_id, f"Timeout : traitement trop long (>{_DOCLING_TIMEOUT//60} min). "
-                                       "Le fichier est peut-être corrompu ou trop complexe.")
+        await _run_pipeline(upload_path, filename, document_id, user_id, http_client)
+    except asyncio.CancelledError:
+        # Arrêt du serveur pendant le traitement : le document ne reste pas "processing"
+        await _set_error(document_id, "Traitement interrompu par l'arrêt du serveur. Veuillez réimporter le fichier.")
+        raise
+    finally:
+        _live_documents.pop(document_id, None)
+        await asyncio.to_thread(_remove_upload, upload_path)
 
 
 async def _run_pipeline(
-    file_bytes: bytes,
+    upload_path: str,
     filename: str,
-    document_id: str,
+    document_id: UUID,
     user_id: str,
-    http_client=None,
+    http_client: httpx.AsyncClient,
 ) -> None:
     async with AsyncSessionLocal() as db:
         try:
             await _update_progress(document_id, 10, "Conversion du document en cours…")
             logger.info(f"[{document_id}] Début conversion Docling")
-            chunks, images = await convert_document(file_bytes, filename, document_id)
+            # Délai compté dès qu'un worker Docling prend la conversion (pas pendant l'attente)
+            chunks, images = await convert_document(
+                upload_path, filename, str(document_id), timeout=_DOCLING_TIMEOUT,
+            )
             if not chunks:
                 raise ValueError("Aucun chunk produit après conversion")
 
             await _update_progress(document_id, 40, f"Document converti : {len(chunks)} sections extraites. Sauvegarde des images…")
+            # Un seul passage sur images : lignes DB + index page → fichiers
+            page_images: defaultdict = defaultdict(list)
+            image_rows = []
             for img_data in images:
-                db_image = DocumentImage(
-                    document_id=UUID(document_id),
-                    page=img_data["page"],
-                    filename=img_data["filename"],
-                    mime_type="image/png",
-                )
-                db.add(db_image)
-            await db.flush()
-
-            page_images: dict = {}
-            for img_data in images:
-                page_images.setdefault(img_data["page"], []).append(img_data["filename"])
+                page_images[img_data["page"]].append(img_data["filename"])
+                image_rows.append({
+                    "document_id": document_id,
+                    "page": img_data["page"],
+                    "filename": img_data["filename"],
+                    "mime_type": "image/png",
+                })
+            # INSERT Core en executemany (asyncpg) : pas d'objet ORM ni d'identity map par image
+            if image_rows:
+                await db.execute(insert(DocumentImage), image_rows)
+
+            # Tuple vide partagé pour les pages sans image (pas de liste allouée par chunk)
             for chunk in chunks:
-                chunk["image_filenames"] = page_images.get(chunk.get("page", 1), [])
-
-            await _update_progress(document_id, 60, f"Calcul des embeddings ({len(chunks)} chunks)…")
-            texts = [c["content"] for c in chunks]
-            embeddings = await get_embeddings(texts, http_client)
-
-            await _update_progress(document_id, 85, "Indexation dans la base vectorielle…")
-            await ensure_collection(len(embeddings[0]))
-            count = await upsert_chunks(chunks, embeddings, user_id, document_id)
+                chunk["image_filenames"] = page_images.get(chunk.get("page", 1), ())
 
-            doc = await db.get(Document, UUID(document_id))
-            if doc:
-                doc.status = "ready"
-                doc.chunk_count = count
-                doc.progress = 100
-                doc.status_detail = f"Prêt — {count} chunks indexés, {len(images)} images"
-                await db.commit()
+            await _update_progress(document_id, 60, f"Calcul des embeddings et indexation ({len(chunks)} chunks)…")
+            try:
+                count = await _index_chunks(chunks, document_id, user_id, http_client)
+            except BaseException:
+                # Pas de points orphelins dans Qdrant pour un document en erreur
+                try:
+                    await delete_document_chunks(str(document_id))
+                except Exception as e:
+                    logger.warning(f"[{document_id}] Nettoyage Qdrant impossible : {e}")
+                raise
+
+            # UPDATE direct : pas de SELECT pour recharger la ligne
+            await db.execute(
+                update(Document)
+                .where(Document.id == document_id)
+                .values(
+                    status="ready",
+                    chunk_count=count,
+                    progress=100,
+                    status_detail=f"Prêt — {count} chunks indexés, {len(images)} images",
+                )
+                .execution_options(synchronize_session=False)
+            )
+            await db.commit()
 
             logger.info(f"[{document_id}] ✓ Traitement terminé : {count} chunks, {len(images)} images")
 
+        except asyncio.TimeoutError:
+            logger.error(f"[{document_id}] Timeout conversion après {_DOCLING_TIMEOUT//60} minutes")
+            await _set_error(document_id, f"Timeout : traitement trop long (>{_DOCLING_TIMEOUT//60} min). "
+                                           "Le fichier est peut-être corrompu ou trop complexe.")
         except Exception as e:
             logger.error(f"[{document_id}] Erreur pipeline : {e}", exc_info=True)
             await _set_error(document_id, str(e)[:500])
 
 
-async def _set_error(document_id: str, message: str) -> None:
+async def _index_chunks(
+    chunks: list,
+    document_id: UUID,
+    user_id: str,
+    http_client: httpx.AsyncClient,
+) -> int:
+    """
+    Embeddings et upsert Qdrant en deux étages reliés par une file bornée :
+    le lot N est upserté pendant que le lot N+1 est envoyé à Ollama.
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize=2)
+    # Textes identiques (en-têtes, pieds de page répétés…) embeddés une seule fois :
+    # le vecteur est ensuite attribué à chaque chunk qui porte ce texte
+    by_text: Dict[str, list] = defaultdict(list)
+    for chunk in chunks:
+        by_text[chunk["content"]].append(chunk)
+    # Lots de longueurs homogènes (moins de padding côté modèle d'embedding). Chaque point
+    # Qdrant porte son propre chunk (chunk_index, page…) : l'ordre d'envoi est sans effet
+    texts = sorted(by_text, key=len)
+    if len(texts) < len(chunks):
+        logger.info(f"[{document_id}] {len(chunks) - len(texts)} chunks dupliqués non ré-embeddés")
+
+    async def embed_stage() -> None:
+        for i in range(0, len(texts), _INDEX_BATCH_SIZE):
+            batch_texts = texts[i:i + _INDEX_BATCH_SIZE]
+            vectors = await get_embeddings(batch_texts, http_client)
+            # Ligne de la matrice d'embeddings de chaque chunk du lot
+            batch, rows = [], []
+            for row, text in enumerate(batch_texts):
+                for chunk in by_text[text]:
+                    batch.append(chunk)
+                    rows.append(row)
+            await queue.put((batch, vectors[rows]))
+        await queue.put(None)
+
+    # Forme texte (payload Qdrant) calculée une fois, pas à chaque lot
+    document_key = str(document_id)
+
+    async def upsert_stage() -> int:
+        total = 0
+        while (item := await queue.get()) is not None:
+            batch, embeddings = item
+            await ensure_collection(embeddings.shape[1])
+            total += await upsert_chunks(batch, embeddings, user_id, document_key)
+        return total
+
+    try:
+        async with asyncio.TaskGroup() as tg:
+            tg.create_task(embed_stage())
+            upserted = tg.create_task(upsert_stage())
+    except ExceptionGroup as eg:
+        # Erreur d'origine (et non le groupe) pour le message stocké sur le document
+        raise eg.exceptions[0] from eg
+    return upserted.result()
+
+
+async def _set_error(document_id: UUID, message: str) -> None:
+    _live_documents.pop(document_id, None)
     try:
         async with AsyncSessionLocal() as db:
-            doc = await db.get(Document, UUID(document_id))
-            if doc:
-                doc.status = "error"
-                doc.progress = 0
-                doc.status_detail = message
-                doc.error_message = message
-                await db.commit()
+            await db.execute(
+                update(Document)
+                .where(Document.id == document_id)
+                .values(status="error", progress=0, status_detail=message, error_message=message)
+                .execution_options(synchronize_session=False)
+            )
+            await db.commit()
     except Exception as e:
         logger.error(f"[{document_id}] Impossible de marquer l'erreur en DB : {e}")
 
 
+def _unlink_images(filenames: list[str]) -> None:
+    """Supprime les fichiers image (bloquant — appelé via asyncio.to_thread)."""
+    for fname in filenames:
+        try:
+            os.unlink(os.path.join(IMAGES_DIR, fname))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"Impossible de supprimer l'image {fname}: {e}")
+
+
 @router.get("/", response_model=list[DocumentOut])
 async def list_documents(
     db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_user),
+    # Sans limit : liste complète (sélecteur de documents du frontend)
+    limit: Optional[int] = Query(default=None, ge=1, le=500),
+    # Pagination keyset : (created_at, id) du dernier document de la page précédente ;
+    # l'id départage les documents créés au même instant
+    before: Optional[datetime] = Query(default=None),
+    before_id: Optional[UUID] = Query(default=None),
 ):
-    result = await db.execute(select(Document).order_by(Document.created_at.desc()))
-    return result.scalars().all()
+    # Colonnes de DocumentOut uniquement, parcours de l'index ix_docs_created
+    stmt = (
+        select(*_DOCUMENT_OUT_COLUMNS)
+        .order_by(Document.created_at.desc(), Document.id.desc())
+    )
+    if before is not None and before_id is not None:
+        stmt = stmt.where(tuple_(Document.created_at, Document.id) < (before, before_id))
+    elif before is not None:
+        stmt = stmt.where(Document.created_at < before)
+    if limit is not None:
+        stmt = stmt.limit(limit)
+
+    # Même schéma que admin.list_users : lignes sérialisées telles quelles par orjson
+    # (UUID, datetime natifs), sans instance ORM ni modèle pydantic intermédiaire
+    result = await db.stream(stmt)
+    return ORJSONResponse([row._asdict() async for row in result])
 
 
 @router.delete("/all", status_code=204)
@@ -205,73 +490,95 @@ async def delete_all_documents(
     current_user: User = Depends(get_current_user),
 ):
     """Supprime tous les documents de la base."""
-    result = await db.execute(select(Document))
-    docs = result.scalars().all()
-    for doc in docs:
-        img_result = await db.execute(
-            select(DocumentImage).where(DocumentImage.document_id == doc.id)
-        )
-        images = img_result.scalars().all()
-        await delete_document_chunks(str(doc.id), str(current_user.id))
-        await db.delete(doc)
-        for img in images:
-            try:
-                filepath = os.path.join(IMAGES_DIR, img.filename)
-                if os.path.exists(filepath):
-                    os.unlink(filepath)
-            except OSError as e:
-                logger.warning(f"Impossible de supprimer l'image {img.filename}: {e}")
+    image_files = (await db.execute(select(DocumentImage.filename))).scalars().all()
+
+    # Un seul DELETE SQL (images via ON DELETE CASCADE), ids récupérés via RETURNING,
+    # puis suppression Qdrant filtrée sur ces ids avant le commit : en cas d'échec
+    # Qdrant, la transaction est annulée et les documents restent listés
+    doc_ids = (await db.execute(delete(Document).returning(Document.id))).scalars().all()
+    await delete_documents_chunks([str(doc_id) for doc_id in doc_ids])
     await db.commit()
+    _live_documents.clear()
+
+    await asyncio.to_thread(_unlink_images, image_files)
 
 
 @router.get("/{document_id}/status", response_model=DocumentOut)
 async def get_document_status(
-    document_id: str,
+    document_id: UUID,
     db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_user),
 ):
-    doc = await db.get(Document, UUID(document_id))
-    if not doc:
+    # Endpoint sondé toutes les 2s pendant un traitement : document en cours servi
+    # depuis la mémoire (aucune requête SQL), sinon lecture par colonnes et
+    # sérialisation orjson directe, sans instance ORM ni revalidation response_model
+    live = _live_documents.get(document_id)
+    if live is not None:
+        return ORJSONResponse(live)
+    row = (await db.execute(
+        select(*_DOCUMENT_OUT_COLUMNS).where(Document.id == document_id)
+    )).one_or_none()
+    if row is None:
         raise HTTPException(404, "Document introuvable")
-    return doc
+    return ORJSONResponse(DocumentOut.model_construct(**row._asdict()).model_dump())
 
 
 @router.get("/images/{filename}")
 async def get_image(
     filename: str,
+    request: Request,
     current_user: User = Depends(get_current_user),
 ):
-    if "/" in filename or "\\" in filename or ".." in filename:
+    # Liste blanche de caractères (pas de séparateur possible) + vérification du chemin
+    # résolu en défense en profondeur (liens symboliques)
+    if not _SAFE_FILENAME(filename):
+        raise HTTPException(400, "Nom de fichier invalide")
+    filepath = os.path.realpath(os.path.join(IMAGES_DIR, filename))
+    if not filepath.startswith(_IMAGES_ROOT):
         raise HTTPException(400, "Nom de fichier invalide")
-    filepath = os.path.join(IMAGES_DIR, filename)
-    if not os.path.exists(filepath):
+    try:
+        stat_result = os.stat(filepath)
+    except FileNotFoundError:
         raise HTTPException(404, "Image introuvable")
-    return FileResponse(filepath, media_type="image/png")
+    # ETag dérivé du stat (sans lire le fichier) ; image déjà en cache côté client → 304
+    etag = f'"{stat_result.st_ino:x}-{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"'
+    headers = {"ETag": etag, "Cache-Control": "private, max-age=86400"}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag in (t.strip().removeprefix("W/") for t in if_none_match.split(",")):
+        return Response(status_code=304, headers=headers)
+    # stat transmis à FileResponse (pas de second stat) ; envoi via sendfile.
+    # Images immuables (nom unique par document).
+    return FileResponse(
+        filepath,
+        media_type="image/png",
+        stat_result=stat_result,
+        headers=headers,
+    )
 
 
 @router.delete("/{document_id}", status_code=204)
 async def delete_document(
-    document_id: str,
+    document_id: UUID,
     db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_user),
 ):
-    doc = await db.get(Document, UUID(document_id))
-    if not doc:
-        raise HTTPException(404, "Document introuvable")
-
+    # Lignes images supprimées dans la transaction, fichiers récupérés via RETURNING
+    # (pas de SELECT préalable ni de cascade ORM)
     result = await db.execute(
-        select(DocumentImage).where(DocumentImage.document_id == UUID(document_id))
+        delete(DocumentImage)
+        .where(DocumentImage.document_id == document_id)
+        .returning(DocumentImage.filename)
     )
-    images = result.scalars().all()
+    image_files = result.scalars().all()
 
-    await delete_document_chunks(document_id, str(current_user.id))
-    await db.delete(doc)
+    # DELETE SQL direct, rowcount = 0 → document inexistant (et rollback implicite),
+    # vérifié avant de toucher à Qdrant. Suppression Qdrant ensuite, avant le commit :
+    # en cas d'échec, la transaction est annulée et le document reste supprimable.
+    deleted = await db.execute(delete(Document).where(Document.id == document_id))
+    if deleted.rowcount == 0:
+        raise HTTPException(404, "Document introuvable")
+    await delete_document_chunks(str(document_id), str(current_user.id))
     await db.commit()
+    _live_documents.pop(document_id, None)
 
-    for img in images:
-        try:
-            filepath = os.path.join(IMAGES_DIR, img.filename)
-            if os.path.exists(filepath):
-                os.unlink(filepath)
-        except OSError as e:
-            logger.warning(f"Impossible de supprimer l'image {img.filename}: {e}")
+    await asyncio.to_thread(_unlink_images, image_files)
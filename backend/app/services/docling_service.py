@@ -1,17 +1,173 @@
 # -*- coding: utf-8 -*-
 import asyncio
 import logging
+import multiprocessing
 import os
 import re
-import tempfile
-import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from app.config import settings
 
 logger = logging.getLogger(__name__)
 
-# Lock pour sérialiser les conversions Docling (PyTorch non thread-safe)
-_DOCLING_LOCK = threading.Lock()
+# Conversions Docling dans des processus workers : le travail CPU (OCR, layout, PyTorch)
+# ne contend plus le GIL de la boucle asyncio (SSE, API). "spawn" : pas de fork d'un
+# parent qui a pu initialiser CUDA. Chaque worker charge ses modèles une fois.
+#
+# Pool maison plutôt que ProcessPoolExecutor : tuer un worker d'un ProcessPoolExecutor
+# casse tout le pool (BrokenProcessPool pour les autres conversions en cours). Ici
+# chaque worker a son propre pipe ; une conversion annulée ou hors délai ne tue que
+# le processus qui l'exécute, remplacé aussitôt.
+
+
+def _worker_main(conn: Any) -> None:
+    """Boucle d'un processus worker : exécute (fn, args) reçus, renvoie (ok, résultat)."""
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            return
+        if message is None:
+            return
+        fn, args = message
+        try:
+            reply = (True, fn(*args))
+        except BaseException as e:
+            reply = (False, e)
+        try:
+            conn.send(reply)
+        except Exception as e:
+            # Résultat ou exception non sérialisable
+            conn.send((False, RuntimeError(f"{type(e).__name__}: {e}")))
+
+
+class _DoclingWorker:
+    def __init__(self, ctx: Any) -> None:
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_main, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def call(self, fn: Any, args: tuple) -> Tuple[bool, Any]:
+        # Bloquant : exécuté dans un thread du pool. EOFError si le processus est tué.
+        self.conn.send((fn, args))
+        return self.conn.recv()
+
+    def stop(self, kill: bool = False) -> None:
+        if kill:
+            self.process.kill()
+        else:
+            try:
+                self.conn.send(None)
+            except OSError:
+                pass
+            self.process.join(timeout=5)
+            if self.process.is_alive():
+                self.process.kill()
+        self.process.join(timeout=5)
+        self.conn.close()
+
+
+class DoclingPool:
+    def __init__(self, size: int) -> None:
+        self._ctx = multiprocessing.get_context("spawn")
+        self._closed = False
+        self._workers = [_DoclingWorker(self._ctx) for _ in range(size)]
+        self._idle: asyncio.Queue = asyncio.Queue()
+        for worker in self._workers:
+            self._idle.put_nowait(worker)
+        # Un thread par worker, bloqué sur la réception du résultat
+        self._threads = ThreadPoolExecutor(max_workers=size, thread_name_prefix="docling")
+        # Remplacements de workers tués en cours (références fortes sur les tâches)
+        self._replacing: Set[asyncio.Task] = set()
+
+    async def run(self, fn: Any, *args: Any, timeout: Optional[float] = None) -> Any:
+        """
+        Exécute fn(*args) dans un worker libre. Le délai `timeout` ne court qu'à partir
+        du moment où un worker prend la tâche (pas pendant l'attente d'un worker libre).
+        Annulation ou délai dépassé : seul ce worker est tué puis remplacé.
+        """
+        worker: _DoclingWorker = await self._idle.get()
+        loop = asyncio.get_running_loop()
+        reusable = False
+        try:
+            ok, value = await asyncio.wait_for(
+                loop.run_in_executor(self._threads, worker.call, fn, args), timeout,
+            )
+            reusable = True
+        except TimeoutError:
+            # Sous-classe d'OSError : à laisser passer tel quel
+            raise
+        except (EOFError, OSError) as e:
+            raise RuntimeError(f"Worker Docling arrêté pendant la conversion : {e!r}")
+        finally:
+            self._release(worker, reusable)
+        if not ok:
+            raise value
+        return value
+
+    def _release(self, worker: _DoclingWorker, reusable: bool) -> None:
+        if reusable and not self._closed:
+            self._idle.put_nowait(worker)
+            return
+        # kill/join et spawn bloquants : remplacement en tâche de fond, hors de la boucle
+        task = asyncio.get_running_loop().create_task(self._replace(worker))
+        self._replacing.add(task)
+        task.add_done_callback(self._replacing.discard)
+
+    async def _replace(self, worker: _DoclingWorker) -> None:
+        # Thread par défaut et non self._threads : ses threads peuvent tous être bloqués
+        # sur un recv, dont celui du worker à tuer
+        await asyncio.to_thread(worker.stop, True)
+        if self._closed:
+            return
+        self._workers.remove(worker)
+        logger.warning(f"[Docling] Worker {worker.process.pid} tué — remplacé")
+        replacement = await asyncio.to_thread(_DoclingWorker, self._ctx)
+        self._workers.append(replacement)
+        if _DOCLING_OK:
+            # Modèles chargés avant toute conversion : sinon la suivante paierait le
+            # chargement dans son propre délai
+            try:
+                ok, value = await asyncio.to_thread(
+                    replacement.call, _warm_up_sync, (settings.DOCLING_OCR,),
+                )
+                if not ok:
+                    logger.warning(f"[Docling] Préchargement du worker de remplacement échoué : {value!r}")
+            except (EOFError, OSError) as e:
+                logger.warning(f"[Docling] Préchargement du worker de remplacement échoué : {e!r}")
+        if self._closed:
+            # Arrêt du pool pendant le préchargement : shutdown a déjà vidé _workers
+            await asyncio.to_thread(replacement.stop, True)
+            return
+        self._idle.put_nowait(replacement)
+
+    def shutdown(self, kill: bool = False) -> None:
+        self._closed = True
+        for worker in list(self._workers):
+            worker.stop(kill=kill)
+        self._workers.clear()
+        self._threads.shutdown(wait=False, cancel_futures=True)
+
+
+_docling_pool: Optional[DoclingPool] = None
+
+
+def get_docling_pool() -> DoclingPool:
+    global _docling_pool
+    if _docling_pool is None:
+        _docling_pool = DoclingPool(settings.DOCLING_WORKERS)
+    return _docling_pool
+
+
+def shutdown_docling_pool(kill: bool = False) -> None:
+    """Arrête les workers (kill=True : sans attendre la fin d'une conversion)."""
+    global _docling_pool
+    pool, _docling_pool = _docling_pool, None
+    if pool is not None:
+        pool.shutdown(kill=kill)
 
 IMAGES_DIR = "/app/images_storage"
 try:
@@ -25,6 +181,11 @@ except Exception as e:
     _DOCLING_OK = False
     logger.error(f"Docling import échoué: {e}")
 
+try:
+    import pypdfium2 as pdfium
+except ImportError:
+    pdfium = None
+
 EXT_TO_FORMAT: Dict[str, Any] = {}
 DOCX_ALIASES = {".dotx", ".doc", ".odt"}
 
@@ -46,12 +207,49 @@ else:
         ".pdf": "pdf", ".docx": "docx",
     }
 
+# Extension → (format Docling, extension exposée à Docling), alias DOCX déjà remappés.
+# Vide sans Docling : tout passe par le fallback.
+_EXT_RESOLUTION: Dict[str, Tuple[Any, str]] = {
+    ext: (fmt, ".docx" if ext in DOCX_ALIASES else ext)
+    for ext, fmt in EXT_TO_FORMAT.items()
+} if _DOCLING_OK else {}
+
+# Expressions compilées une seule fois au chargement du module (pas à chaque document)
+_HEADING_RE = re.compile(r"^(#{1,6}\s.+)$", re.MULTILINE)
+# Premier titre markdown d'un chunk, même indenté — équivalent à tester chaque ligne strip()ée
+_INLINE_HEADING_RE = re.compile(r"^[^\S\n]*#{1,6}[^\S\n]+(\S.*)", re.MULTILINE)
+_IMAGE_TAG_RE = re.compile(r'<!--\s*image\s*-->', re.IGNORECASE)
+_COPYRIGHT_LINE_RE = re.compile(r'^\s*©.*$', re.MULTILINE)
+_PAGE_FOOTER_RE = re.compile(r'(?i)page\s+\d+\s+sur\s+\d+')
+_URL_LINE_RE = re.compile(r'^\s*https?://\S+\s*$', re.MULTILINE)
+_DATETIME_LINE_RE = re.compile(r'^\s*\d{1,2}/\d{1,2}/\d{4}\s+\d{2}:\d{2}\s*$', re.MULTILINE)
+_BLANK_LINES_RE = re.compile(r'\n{3,}')
+# Paragraphe = suite de lignes sans ligne vide ("\n\n") à l'intérieur
+_PARA_RE = re.compile(r"[^\n]+(?:\n(?!\n)[^\n]*)*")
+
 def _ensure_images_dir() -> None:
     os.makedirs(IMAGES_DIR, exist_ok=True)
 
-def _build_converter(ext: str) -> "DocumentConverter":
+# Convertisseurs réutilisés d'une conversion à l'autre dans chaque worker du pool :
+# les modèles (layout, OCR, TableFormer) ne sont chargés qu'une fois par processus.
+# Pas de verrou : un worker du DoclingPool exécute une seule tâche à la fois.
+_converters: Dict[str, "DocumentConverter"] = {}
+
+
+def _get_converter(ext: str, ocr: bool = True) -> "DocumentConverter":
+    if ext == ".pdf":
+        kind = "pdf-ocr" if ocr else "pdf"
+    else:
+        kind = "default"
+    converter = _converters.get(kind)
+    if converter is None:
+        converter = _converters[kind] = _build_converter(ext, ocr)
+    return converter
+
+
+def _build_converter(ext: str, ocr: bool = True) -> "DocumentConverter":
     opts = PdfPipelineOptions()
-    opts.do_ocr = True
+    opts.do_ocr = ocr
     opts.do_table_structure = True
     opts.images_scale = 2.0
     opts.generate_page_images = True
@@ -76,17 +274,17 @@ def _clean_markdown(markdown: str) -> str:
     - Lignes vides multiples
     """
     # Supprimer les balises <!-- image -->
-    markdown = re.sub(r'<!--\s*image\s*-->', '', markdown, flags=re.IGNORECASE)
+    markdown = _IMAGE_TAG_RE.sub('', markdown)
     # Supprimer les lignes copyright (©...)
-    markdown = re.sub(r'^\s*©.*$', '', markdown, flags=re.MULTILINE)
+    markdown = _COPYRIGHT_LINE_RE.sub('', markdown)
     # Supprimer "Page X sur Y" (avec variantes majuscules/minuscules)
-    markdown = re.sub(r'(?i)page\s+\d+\s+sur\s+\d+', '', markdown)
+    markdown = _PAGE_FOOTER_RE.sub('', markdown)
     # Supprimer les URLs seules sur une ligne
-    markdown = re.sub(r'^\s*https?://\S+\s*$', '', markdown, flags=re.MULTILINE)
+    markdown = _URL_LINE_RE.sub('', markdown)
     # Supprimer les dates/heures seules sur une ligne (ex: "16/02/2026 14:17")
-    markdown = re.sub(r'^\s*\d{1,2}/\d{1,2}/\d{4}\s+\d{2}:\d{2}\s*$', '', markdown, flags=re.MULTILINE)
+    markdown = _DATETIME_LINE_RE.sub('', markdown)
     # Nettoyer les lignes vides multiples (max 2 de suite)
-    markdown = re.sub(r'\n{3,}', '\n\n', markdown)
+    markdown = _BLANK_LINES_RE.sub('\n\n', markdown)
     return markdown.strip()
 
 def _chunk_markdown(
@@ -95,107 +293,256 @@ def _chunk_markdown(
     max_chars: int = 3000,
     overlap: int = 450,
 ) -> List[Dict[str, Any]]:
-    heading_re = re.compile(r"^(#{1,6}\s.+)$", re.MULTILINE)
-    parts = heading_re.split(markdown)
+    stem = Path(filename).stem
+    def _parts():
+        # Équivalent paresseux de _HEADING_RE.split(markdown) : texte, titre, texte, …
+        pos = 0
+        for m in _HEADING_RE.finditer(markdown):
+            yield markdown[pos:m.start()]
+            yield m.group(1)
+            pos = m.end()
+        yield markdown[pos:]
+
     sections: List[Dict[str, str]] = []
-    current_heading = Path(filename).stem
-    buffer = ""
-    for part in parts:
+    current_heading = stem
+    # Morceaux de la section courante, assemblés une seule fois (pas de += répétés)
+    buffer: List[str] = []
+    for part in _parts():
         part = part.strip()
         if not part:
             continue
-        if heading_re.match(part):
-            if buffer.strip():
-                sections.append({"heading": current_heading, "content": buffer.strip()})
+        if _HEADING_RE.match(part):
+            if buffer:
+                sections.append({"heading": current_heading, "content": "\n".join(buffer)})
             current_heading = part.lstrip("#").strip()
-            buffer = part + "\n"
+            buffer = [part]
         else:
-            buffer += part + "\n"
-    if buffer.strip():
-        sections.append({"heading": current_heading, "content": buffer.strip()})
+            buffer.append(part)
+    if buffer:
+        sections.append({"heading": current_heading, "content": "\n".join(buffer)})
     if not sections:
-        sections = [{"heading": Path(filename).stem, "content": markdown}]
+        sections = [{"heading": stem, "content": markdown}]
     chunks: List[Dict[str, Any]] = []
     last_chunk_tail = ""
     def _add_chunk(title: str, text: str, page: int) -> None:
         nonlocal last_chunk_tail
-        prefixed = (last_chunk_tail + "\n\n" + text).strip() if last_chunk_tail else text.strip()
+        # Un seul strip() du texte, réutilisé pour le contenu et la queue de recouvrement
+        text = text.strip()
+        prefixed = (last_chunk_tail + "\n\n" + text).strip() if last_chunk_tail else text
         real_title = title
-        for line in prefixed.split("\n"):
-            m = re.match(r"^#{1,6}\s+(.+)", line.strip())
-            if m:
-                real_title = f"{Path(filename).stem} — {m.group(1).strip()}"
-                break
+        m = _INLINE_HEADING_RE.search(prefixed)
+        if m:
+            real_title = f"{stem} — {m.group(1).strip()}"
         chunks.append({
             "page": page,
             "title": real_title,
             "content": prefixed,
             "chunk_index": len(chunks),
         })
-        last_chunk_tail = text.strip()[-overlap:] if len(text.strip()) > overlap else text.strip()
+        last_chunk_tail = text[-overlap:]
     for i, section in enumerate(sections):
         text = section["content"]
-        title = f"{Path(filename).stem} — {section['heading']}"
+        title = f"{stem} — {section['heading']}"
         page = i + 1
         if len(text) <= max_chars:
             _add_chunk(title, text, page)
         else:
-            paragraphs = [p.strip() for p in text.split("\n\n") if p.strip()]
-            buf = ""
+            # Paragraphes parcourus paresseusement, sans liste intermédiaire de la section
+            paragraphs = (m.group().strip() for m in _PARA_RE.finditer(text))
+            # Paragraphes du chunk en cours + longueur équivalente à "\n\n".join(buf) + "\n\n"
+            buf: List[str] = []
+            buf_len = 0
             for para in paragraphs:
-                if buf and len(buf) + len(para) + 2 > max_chars:
-                    _add_chunk(title, buf.strip(), page)
-                    buf = para + "\n\n"
+                if not para:
+                    continue
+                if buf and buf_len + len(para) + 2 > max_chars:
+                    _add_chunk(title, "\n\n".join(buf), page)
+                    buf = [para]
+                    buf_len = len(para) + 2
                 else:
-                    buf += para + "\n\n"
-            if buf.strip():
-                _add_chunk(title, buf.strip(), page)
+                    buf.append(para)
+                    buf_len += len(para) + 2
+            if buf:
+                _add_chunk(title, "\n\n".join(buf), page)
     return chunks or [{"page": 1, "title": filename, "content": "(vide)", "chunk_index": 0}]
 
-def _save_images_sync(result: Any, document_id: str) -> List[Dict[str, Any]]:
+def _save_png(task: Tuple[Any, str]) -> bool:
+    pil_image, fpath = task
+    try:
+        # compress_level=1 : zlib rapide, l'encodage PNG domine sinon à images_scale=2.0
+        pil_image.save(fpath, "PNG", compress_level=1)
+        return True
+    except Exception as e:
+        logger.warning(f"Image non enregistrée {fpath} : {e}")
+        return False
+
+
+def _save_images_sync(result: Any, document_id: str, page_offset: int = 0) -> List[Dict[str, Any]]:
+    """
+    page_offset : numéro de la première page - 1 quand `result` est une tranche de PDF.
+    Les images sont d'abord collectées puis encodées en parallèle (PIL relâche le GIL
+    pendant l'encodage).
+    """
     _ensure_images_dir()
-    saved: List[Dict[str, Any]] = []
+    entries: List[Dict[str, Any]] = []
+    tasks: List[Tuple[Any, str]] = []
     try:
         doc = result.document
-        for page_no, page in enumerate(doc.pages, start=1):
+        for page_no, page in enumerate(doc.pages, start=page_offset + 1):
             if hasattr(page, 'image') and page.image is not None:
                 img = page.image
                 if hasattr(img, 'pil_image') and img.pil_image is not None:
                     fname = f"{document_id}_page_{page_no}.png"
-                    fpath = os.path.join(IMAGES_DIR, fname)
-                    img.pil_image.save(fpath, "PNG")
-                    saved.append({"page": page_no, "filename": fname, "type": "page"})
+                    tasks.append((img.pil_image, os.path.join(IMAGES_DIR, fname)))
+                    entries.append({"page": page_no, "filename": fname, "type": "page"})
         for elem_idx, element in enumerate(doc.elements or []):
             if hasattr(element, 'image') and element.image is not None:
                 img = element.image
                 if hasattr(img, 'pil_image') and img.pil_image is not None:
                     page_no = getattr(getattr(element, 'prov', [None])[0], 'page', 1) if getattr(element, 'prov', None) else 1
+                    page_no += page_offset
                     fname = f"{document_id}_img_{elem_idx}_p{page_no}.png"
-                    fpath = os.path.join(IMAGES_DIR, fname)
-                    img.pil_image.save(fpath, "PNG")
-                    saved.append({"page": page_no, "filename": fname, "type": "inline"})
+                    tasks.append((img.pil_image, os.path.join(IMAGES_DIR, fname)))
+                    entries.append({"page": page_no, "filename": fname, "type": "inline"})
     except Exception as e:
         logger.warning(f"Extraction images partielle : {e}")
+    saved: List[Dict[str, Any]] = []
+    if tasks:
+        # Cœurs partagés entre les DOCLING_WORKERS processus qui encodent en même temps
+        threads = max(1, (os.cpu_count() or 1) // max(1, settings.DOCLING_WORKERS))
+        with ThreadPoolExecutor(max_workers=min(len(tasks), threads)) as executor:
+            saved = [entry for entry, ok in zip(entries, executor.map(_save_png, tasks)) if ok]
     logger.info(f"[Images] {len(saved)} images extraites pour document {document_id}")
     return saved
 
+def _needs_ocr(markdown: str, page_count: int) -> bool:
+    """Trop peu de texte extrait des flux PDF (hors balises image) : pages scannées."""
+    text_chars = len(_IMAGE_TAG_RE.sub("", markdown).strip())
+    return text_chars < settings.DOCLING_OCR_MIN_CHARS_PER_PAGE * max(1, page_count)
+
+
 def _convert_sync(
     tmp_path: str,
     ext: str,
-    filename: str,
     document_id: str,
-) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
-    """Retourne (chunks, images)"""
-    converter = _build_converter(ext)
-    result = converter.convert(tmp_path)
-    markdown: str = result.document.export_to_markdown()
+    page_offset: int = 0,
+    ocr: str = "auto",
+) -> Tuple[str, List[Dict[str, Any]]]:
+    """
+    Retourne (markdown brut, images) — aussi pour une tranche de PDF (page_offset).
+    Seul ce qui a besoin du résultat Docling tourne dans le worker du pool : le
+    nettoyage et le chunking du markdown se font côté parent, le worker est libéré
+    pour la conversion suivante.
+    ocr="auto" (PDF) : première passe sans OCR, relancée avec OCR seulement si
+    les flux texte du PDF sont quasi vides — l'OCR domine le temps de conversion.
+    """
+    if ext == ".pdf" and ocr == "auto":
+        result = _get_converter(ext, ocr=False).convert(tmp_path)
+        markdown: str = result.document.export_to_markdown() or ""
+        if _needs_ocr(markdown, len(result.document.pages)):
+            logger.info(f"[Docling] Peu de texte natif dans '{tmp_path}' → conversion avec OCR")
+            result = _get_converter(ext, ocr=True).convert(tmp_path)
+            markdown = result.document.export_to_markdown() or ""
+    else:
+        result = _get_converter(ext, ocr=ocr != "off").convert(tmp_path)
+        markdown = result.document.export_to_markdown() or ""
+    if not markdown or markdown.isspace():
+        # Aucun texte : pas de parcours des pages/éléments ni d'encodage d'images
+        return "", []
+    return markdown, _save_images_sync(result, document_id, page_offset)
+
+
+def _warm_up_sync(ocr: str) -> None:
+    """Charge dans le worker le pipeline PDF de la première passe (modèles layout, TableFormer, OCR si "on")."""
+    if _DOCLING_OK:
+        _get_converter(".pdf", ocr=ocr == "on").initialize_pipeline(InputFormat.PDF)
+
+
+async def warm_up_docling_pool() -> None:
+    """
+    Précharge les modèles Docling dans chaque worker au démarrage : sans cela le
+    premier upload traité par un worker paie le chargement des modèles.
+    Un échec n'empêche pas le démarrage (chargement à la première conversion).
+    """
+    if not _DOCLING_OK:
+        return
+    pool = get_docling_pool()
+    # Une tâche par worker : chacune garde son worker jusqu'à la fin du chargement
+    results = await asyncio.gather(
+        *(pool.run(_warm_up_sync, settings.DOCLING_OCR) for _ in range(settings.DOCLING_WORKERS)),
+        return_exceptions=True,
+    )
+    failed = [r for r in results if isinstance(r, BaseException)]
+    for error in failed:
+        logger.warning(f"[Docling] Préchargement des modèles échoué : {error!r}")
+    logger.info(f"[Docling] Modèles préchargés dans {len(results) - len(failed)}/{len(results)} worker(s)")
+
+
+def _markdown_to_chunks(markdown: str, filename: str) -> List[Dict[str, Any]]:
     if not markdown or not markdown.strip():
-        return [{"page": 1, "title": filename, "content": "(document vide)", "chunk_index": 0}], []
+        return [{"page": 1, "title": filename, "content": "(document vide)", "chunk_index": 0}]
     # ✅ Nettoyage des parasites avant le chunking
-    markdown = _clean_markdown(markdown)
-    chunks = _chunk_markdown(markdown, filename)
-    images = _save_images_sync(result, document_id)
-    return chunks, images
+    return _chunk_markdown(_clean_markdown(markdown), filename)
+
+
+def _split_pdf_sync(path: str, shard_pages: int) -> List[Tuple[str, int]]:
+    """
+    Découpe le PDF en tranches de `shard_pages` pages (fichiers voisins de `path`).
+    Retourne [(chemin_tranche, page_offset)], ou [] si le PDF est assez court
+    ou ne peut pas être découpé (il est alors converti d'un bloc).
+    """
+    if pdfium is None:
+        return []
+    try:
+        src = pdfium.PdfDocument(path)
+    except Exception as e:
+        logger.warning(f"[Docling] Découpage PDF impossible, conversion d'un bloc : {e}")
+        return []
+    shards: List[Tuple[str, int]] = []
+    try:
+        page_count = len(src)
+        if page_count <= shard_pages:
+            return []
+        base = os.path.splitext(path)[0]
+        for start in range(0, page_count, shard_pages):
+            shard = pdfium.PdfDocument.new()
+            try:
+                shard.import_pages(src, list(range(start, min(start + shard_pages, page_count))))
+                shard_path = f"{base}.p{start}.pdf"
+                shard.save(shard_path)
+            finally:
+                shard.close()
+            shards.append((shard_path, start))
+        return shards
+    except Exception as e:
+        logger.warning(f"[Docling] Découpage PDF impossible, conversion d'un bloc : {e}")
+        _remove_files([p for p, _ in shards])
+        return []
+    finally:
+        src.close()
+
+
+def _remove_files(paths: List[str]) -> None:
+    for path in paths:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+def _pdfium_page_texts(file_bytes: bytes):
+    """Texte de chaque page ; pages et textpages fermées au fur et à mesure (mémoire native bornée)."""
+    pdf = pdfium.PdfDocument(file_bytes)
+    try:
+        for i in range(len(pdf)):
+            page = pdf.get_page(i)
+            textpage = page.get_textpage()
+            try:
+                yield textpage.get_text_range()
+            finally:
+                textpage.close()
+                page.close()
+    finally:
+        pdf.close()
 
 def _fallback_parse(file_bytes: bytes, filename: str) -> str:
     ext = Path(filename).suffix.lower()
@@ -207,16 +554,19 @@ def _fallback_parse(file_bytes: bytes, filename: str) -> str:
                 continue
         return file_bytes.decode("utf-8", errors="replace")
     if ext == ".pdf":
+        # pypdfium2 (PDFium, C++) d'abord : nettement plus rapide que pypdf (pur Python),
+        # gardé en second recours (PDF que PDFium refuse d'ouvrir)
         try:
-            import pypdf, io
-            reader = pypdf.PdfReader(io.BytesIO(file_bytes))
-            pages = [p.extract_text() for p in reader.pages if p.extract_text()]
+            if pdfium is None:
+                raise RuntimeError("pypdfium2 non installé")
+            pages = [text for text in _pdfium_page_texts(file_bytes) if text]
             return "\n\n".join(pages) if pages else "(PDF vide ou non lisible)"
         except Exception:
             try:
-                import pypdfium2 as pdfium
-                pdf = pdfium.PdfDocument(file_bytes)
-                return "\n\n".join(pdf[i].get_textpage().get_text_range() for i in range(len(pdf)))
+                import pypdf, io
+                reader = pypdf.PdfReader(io.BytesIO(file_bytes))
+                pages = [text for text in (p.extract_text() for p in reader.pages) if text]
+                return "\n\n".join(pages) if pages else "(PDF vide ou non lisible)"
             except Exception as e2:
                 raise RuntimeError(f"Impossible de lire le PDF: {e2}")
     if ext in (".docx", ".dotx", ".doc", ".odt"):
@@ -228,36 +578,77 @@ def _fallback_parse(file_bytes: bytes, filename: str) -> str:
             raise RuntimeError(f"Impossible de lire le DOCX: {e}")
     raise ValueError(f"Format non supporté: {ext}")
 
+def _fallback_convert_sync(file_path: str, filename: str) -> List[Dict[str, Any]]:
+    text = _fallback_parse(Path(file_path).read_bytes(), filename)
+    return _chunk_markdown(text, filename)
+
 async def convert_document(
-    file_bytes: bytes,
+    file_path: str,
     filename: str,
     document_id: str = "",
+    ocr: Optional[str] = None,
+    timeout: Optional[float] = None,
 ) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
     """
-    Retourne (chunks, images).
-    FIX .dotx/.doc : on renomme le fichier temporaire en .docx avant de le passer à Docling
-    car Docling valide l'extension du fichier temporaire.
+    Retourne (chunks, images) pour le fichier uploadé `file_path` (lu sur disque,
+    jamais chargé en mémoire côté serveur pour Docling).
+    ocr : "auto" | "on" | "off" (PDF uniquement), settings.DOCLING_OCR par défaut.
+    timeout : délai par conversion (par tranche pour un PDF découpé), compté à partir
+    de la prise en charge par un worker — TimeoutError au-delà.
+    FIX .dotx/.doc : on expose le fichier sous une extension .docx (lien dur) avant de le
+    passer à Docling car Docling valide l'extension du fichier.
     """
     ext = Path(filename).suffix.lower()
-    tmp_ext = ext
-    if ext in DOCX_ALIASES:
-        tmp_ext = ".docx"
-        logger.info(f"[Docling] Extension '{ext}' → renommée en '.docx' pour compatibilité Docling")
+    fmt, tmp_ext = _EXT_RESOLUTION.get(ext, (None, ext))
+    ocr = ocr or settings.DOCLING_OCR
 
-    if _DOCLING_OK and ext in EXT_TO_FORMAT:
-        logger.info(f"[Docling] Conversion '{filename}' ({len(file_bytes):,} bytes)")
+    if fmt is not None:
+        if tmp_ext != ext:
+            logger.info(f"[Docling] Extension '{ext}' → renommée en '.docx' pour compatibilité Docling")
+        logger.info(f"[Docling] Conversion '{filename}' ({os.path.getsize(file_path):,} bytes)")
         tmp_path = None
+        shards: List[Tuple[str, int]] = []
         try:
-            with tempfile.NamedTemporaryFile(suffix=tmp_ext, delete=False, dir="/tmp") as tmp:
-                tmp.write(file_bytes)
-                tmp_path = tmp.name
-            # ✅ Lock pour sérialiser les uploads simultanés (PyTorch non thread-safe)
-            def _run_locked():
-                with _DOCLING_LOCK:
-                    return _convert_sync(tmp_path, tmp_ext, filename, document_id)
-            chunks, images = await asyncio.to_thread(_run_locked)
+            if tmp_ext != ext:
+                # Lien dur : même fichier sous la bonne extension, sans recopie
+                tmp_path = os.path.splitext(file_path)[0] + tmp_ext
+                os.link(file_path, tmp_path)
+            # Pool de DOCLING_WORKERS processus : sérialise les uploads simultanés
+            # (PyTorch non thread-safe) sans bloquer la boucle asyncio
+            pool = get_docling_pool()
+            if ext == ".pdf" and settings.DOCLING_WORKERS > 1:
+                # Gros PDF : tranches de pages converties en parallèle sur les workers
+                shards = await asyncio.to_thread(_split_pdf_sync, file_path, settings.DOCLING_PDF_SHARD_PAGES)
+            if shards:
+                logger.info(f"[Docling] '{filename}' découpé en {len(shards)} tranches")
+                tasks = [
+                    asyncio.ensure_future(pool.run(_convert_sync, path, ".pdf", document_id, offset, ocr, timeout=timeout))
+                    for path, offset in shards
+                ]
+                try:
+                    results = await asyncio.gather(*tasks)
+                except BaseException:
+                    # Une tranche en échec : inutile de laisser les autres occuper les workers
+                    for task in tasks:
+                        task.cancel()
+                    await asyncio.gather(*tasks, return_exceptions=True)
+                    raise
+                markdown = "\n\n".join(md for md, _ in results if md)
+                images = [img for _, shard_images in results for img in shard_images]
+            else:
+                markdown, images = await pool.run(
+                    _convert_sync, tmp_path or file_path, tmp_ext, document_id, 0, ocr, timeout=timeout,
+                )
+            if markdown:
+                chunks = await asyncio.to_thread(_markdown_to_chunks, markdown, filename)
+            else:
+                chunks = _markdown_to_chunks(markdown, filename)
             logger.info(f"[Docling] {len(chunks)} chunks, {len(images)} images pour '{filename}'")
             return chunks, images
+        except (asyncio.CancelledError, TimeoutError):
+            # Le pool a déjà tué (et remplacé) le seul worker concerné
+            logger.warning(f"[Docling] Conversion '{filename}' annulée ou hors délai")
+            raise
         except Exception as e:
             logger.error(f"[Docling] Erreur '{filename}': {e}", exc_info=True)
             raise RuntimeError(f"Erreur Docling: {e}")
@@ -267,9 +658,11 @@ async def convert_document(
                     os.unlink(tmp_path)
                 except OSError:
                     pass
+            if shards:
+                _remove_files([path for path, _ in shards])
     else:
         logger.info(f"[Fallback] Conversion '{filename}'")
-        text = _fallback_parse(file_bytes, filename)
-        chunks = _chunk_markdown(text, filename)
+        # Lecture, extraction et chunking hors de la boucle asyncio (un seul aller-retour thread)
+        chunks = await asyncio.to_thread(_fallback_convert_sync, file_path, filename)
         logger.info(f"[Fallback] {len(chunks)} chunks pour '{filename}'")
         return chunks, []
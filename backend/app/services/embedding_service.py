@@ -1,81 +1,139 @@
 # -*- coding: utf-8 -*-
 import asyncio
+import hashlib
 import logging
-from typing import List, Optional
+import time
+from collections import OrderedDict
+from typing import List, Tuple
 
 import httpx
+import numpy as np
+import orjson
 
 from app.config import settings
 
 logger = logging.getLogger(__name__)
 
-# Taille maximale de batch pour les embeddings Ollama.
-# Au-delà de 8 requêtes parallèles, la qualité cosine se dégrade.
-EMBEDDING_BATCH_SIZE = 8
-
-
-async def get_embedding(text: str, http_client: Optional[httpx.AsyncClient] = None) -> List[float]:
+# Lots /api/embed en vol simultanément
+_EMBED_CONCURRENCY = 2
+
+# Ollama < 0.3.4 n'expose pas /api/embed : détecté au premier 404, on passe alors
+# définitivement par /api/embeddings (un texte par requête)
+_legacy_embed_api = False
+
+# Cache LRU des embeddings de requêtes (questions répétées, suggestions…) :
+# clé = modèle + empreinte du texte, valeur = (expiration monotonic, vecteur)
+_EMBEDDING_CACHE_MAX = 2048
+_EMBEDDING_CACHE_TTL = 3600  # secondes
+_EMBEDDING_CACHE_MAX_TEXT = 8192  # caractères — textes plus longs jamais mis en cache
+_embedding_cache: "OrderedDict[str, Tuple[float, np.ndarray]]" = OrderedDict()
+
+
+async def get_embedding(text: str, http_client: httpx.AsyncClient) -> np.ndarray:
+    """Embedding d'un texte (requête utilisateur), servi depuis le cache LRU si possible."""
+    if len(text) > _EMBEDDING_CACHE_MAX_TEXT:
+        embeddings = await get_embeddings([text], http_client)
+        return embeddings[0]
+    digest = hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+    key = f"{settings.OLLAMA_EMBEDDING_MODEL}:{digest}"
+    cached = _embedding_cache.get(key)
+    if cached is not None:
+        if time.monotonic() < cached[0]:
+            _embedding_cache.move_to_end(key)
+            return cached[1]
+        del _embedding_cache[key]
     embeddings = await get_embeddings([text], http_client)
-    return embeddings[0]
+    # Vecteur partagé entre appelants : lecture seule
+    embedding = embeddings[0]
+    embedding.flags.writeable = False
+    _embedding_cache[key] = (time.monotonic() + _EMBEDDING_CACHE_TTL, embedding)
+    _embedding_cache.move_to_end(key)
+    while len(_embedding_cache) > _EMBEDDING_CACHE_MAX:
+        _embedding_cache.popitem(last=False)
+    return embedding
 
 
-async def get_embeddings(texts: List[str], http_client: Optional[httpx.AsyncClient] = None) -> List[List[float]]:
+async def get_embeddings(texts: List[str], http_client: httpx.AsyncClient) -> np.ndarray:
     """
     Obtient les embeddings pour une liste de textes via Ollama.
-    Traitement par batchs de EMBEDDING_BATCH_SIZE (max 8) en parallèle
-    pour préserver la qualité cosine tout en accélérant l'indexation.
+    Lots de settings.OLLAMA_EMBED_BATCH_SIZE (8 par défaut) textes par requête
+    /api/embed pour préserver la qualité cosine tout en accélérant l'indexation.
+
+    Retourne une matrice float32 (len(texts), dim) : 4 octets par composante au lieu
+    d'un float Python par valeur ; conversion en liste uniquement à la frontière Qdrant.
 
-    FIX : accepte un client HTTP partagé (app.state.http_client) pour éviter
-    de créer un nouveau client à chaque appel.
-    Si aucun client n'est fourni (ex: tests, scripts), un client local est créé.
+    FIX : client HTTP partagé (app.state.http_client) obligatoire — plus de client
+    créé à la volée (nouvelle connexion TCP par appel, pool de connexions perdu).
     """
-    if http_client is not None:
-        return await _do_get_embeddings(texts, http_client)
-    else:
-        async with httpx.AsyncClient(timeout=settings.OLLAMA_TIMEOUT) as client:
-            return await _do_get_embeddings(texts, client)
+    return await _do_get_embeddings(texts, http_client)
 
 
-async def _do_get_embeddings(texts: List[str], client: httpx.AsyncClient) -> List[List[float]]:
+async def _do_get_embeddings(texts: List[str], client: httpx.AsyncClient) -> np.ndarray:
     """
-    Logique interne — requêtes Ollama par batchs de max EMBEDDING_BATCH_SIZE
-    en parallèle avec asyncio.gather().
-    L'ordre des embeddings est préservé.
+    Logique interne — les textes partent par lots de OLLAMA_EMBED_BATCH_SIZE sur
+    /api/embed (un seul aller-retour et une seule passe du modèle par lot, au lieu
+    d'une requête /api/embeddings par texte). Au plus _EMBED_CONCURRENCY lots en
+    vol : le lot suivant est déjà envoyé pendant qu'Ollama calcule le précédent.
+    L'ordre des embeddings est préservé (gather).
     """
-    results: List[List[float]] = []
-
-    # Découper texts en batchs de EMBEDDING_BATCH_SIZE
-    for i in range(0, len(texts), EMBEDDING_BATCH_SIZE):
-        batch = texts[i:i + EMBEDDING_BATCH_SIZE]
-        logger.debug(f"[Embedding] Batch {i // EMBEDDING_BATCH_SIZE + 1} : {len(batch)} chunks en parallèle")
-
-        # Lancer tous les appels du batch en parallèle
-        batch_embeddings = await asyncio.gather(*[
-            _single_embedding(text, client) for text in batch
-        ])
-
-        results.extend(batch_embeddings)
-
-    return results
+    semaphore = asyncio.Semaphore(_EMBED_CONCURRENCY)
+
+    async def _bounded(batch: List[str]) -> np.ndarray:
+        async with semaphore:
+            return await _batch_embeddings(batch, client)
+
+    size = max(1, settings.OLLAMA_EMBED_BATCH_SIZE)
+    batches = [texts[i:i + size] for i in range(0, len(texts), size)]
+    logger.debug(f"[Embedding] {len(texts)} chunks, {len(batches)} lots de {size} max")
+    results = await asyncio.gather(*[_bounded(batch) for batch in batches])
+    if not results:
+        return np.empty((0, 0), dtype=np.float32)
+    return np.vstack(results)
+
+
+async def _batch_embeddings(batch: List[str], client: httpx.AsyncClient) -> np.ndarray:
+    """Calcule les embeddings d'un lot de textes en une requête /api/embed."""
+    global _legacy_embed_api
+    if not _legacy_embed_api:
+        response = await client.post(
+            f"{settings.OLLAMA_BASE_URL}/api/embed",
+            json={"model": settings.OLLAMA_EMBEDDING_MODEL, "input": batch},
+            timeout=settings.OLLAMA_TIMEOUT,
+        )
+        # 404 JSON = modèle introuvable (vraie erreur) ; 404 texte = route absente
+        is_json = response.headers.get("content-type", "").startswith("application/json")
+        if response.status_code != 404 or is_json:
+            response.raise_for_status()
+            # orjson : décodage des milliers de flottants du corps bien plus rapide que json
+            data = orjson.loads(response.content)
+            if "embeddings" in data:
+                embeddings = data["embeddings"]
+                if len(embeddings) != len(batch) or not all(embeddings):
+                    raise ValueError(f"Embeddings vides ou incomplets retournés pour : {batch[0][:50]}")
+                return np.asarray(embeddings, dtype=np.float32)
+        logger.warning("[Embedding] /api/embed indisponible sur ce serveur Ollama — repli sur /api/embeddings")
+        _legacy_embed_api = True
+    embeddings = [await _single_embedding(text, client) for text in batch]
+    return np.asarray(embeddings, dtype=np.float32)
 
 
 async def _single_embedding(text: str, client: httpx.AsyncClient) -> List[float]:
-    """Calcule l'embedding d'un seul texte."""
+    """Calcule l'embedding d'un seul texte (ancienne API /api/embeddings)."""
     response = await client.post(
         f"{settings.OLLAMA_BASE_URL}/api/embeddings",
         json={"model": settings.OLLAMA_EMBEDDING_MODEL, "prompt": text},
     )
     response.raise_for_status()
-    embedding = response.json().get("embedding", [])
+    embedding = orjson.loads(response.content).get("embedding", [])
     if not embedding:
         raise ValueError(f"Embedding vide retourné pour : {text[:50]}")
     return embedding
 
 
-async def verify_embedding_model(http_client: Optional[httpx.AsyncClient] = None) -> int:
+async def verify_embedding_model(http_client: httpx.AsyncClient) -> int:
     """Vérifie le modèle d'embedding et retourne sa dimension."""
     embedding = await get_embedding("test de dimension", http_client)
-    dim = len(embedding)
+    dim = embedding.shape[-1]
     if dim == 0:
         raise ValueError("Le modèle d'embedding retourne des vecteurs vides")
     logger.info(f"Modèle d'embedding OK : {settings.OLLAMA_EMBEDDING_MODEL}, dim={dim}")
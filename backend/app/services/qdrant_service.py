@@ -1,19 +1,36 @@
 # -*- coding: utf-8 -*-
+import asyncio
 import logging
-import math
+import os
 import uuid
 from typing import Any, Dict, List, Optional
 
+import numpy as np
 from qdrant_client import AsyncQdrantClient
 from qdrant_client.models import (
     Distance, FieldCondition, Filter, FilterSelector,
-    MatchAny, MatchValue, PointStruct, VectorParams,
+    MatchAny, MatchValue, PointStruct, QuantizationSearchParams, QueryRequest,
+    ScalarQuantization, ScalarQuantizationConfig, ScalarType, SearchParams, VectorParams,
 )
 
 from app.config import settings
 
 logger = logging.getLogger(__name__)
 
+# Points par requête upsert (corps HTTP borné) et requêtes upsert simultanées
+_UPSERT_BATCH_SIZE = 256
+_UPSERT_CONCURRENCY = 4
+# Ids de documents par requête de suppression filtrée
+_DELETE_BATCH_SIZE = 1000
+
+# int8 par composante (quantile 0.99 : valeurs extrêmes écrêtées), toujours en RAM
+_INT8_QUANTIZATION = ScalarQuantization(
+    scalar=ScalarQuantizationConfig(type=ScalarType.INT8, quantile=0.99, always_ram=True),
+)
+
+# Candidat sans vecteur (MMR désactivé ou vecteur absent)
+_NO_VECTOR = np.empty(0, dtype=np.float32)
+
 _client: Optional[AsyncQdrantClient] = None
 _collection_ready: bool = False
 
@@ -21,7 +38,12 @@ _collection_ready: bool = False
 def get_client() -> AsyncQdrantClient:
     global _client
     if _client is None:
-        _client = AsyncQdrantClient(host=settings.QDRANT_HOST, port=settings.QDRANT_PORT)
+        _client = AsyncQdrantClient(
+            host=settings.QDRANT_HOST,
+            port=settings.QDRANT_PORT,
+            grpc_port=settings.QDRANT_GRPC_PORT,
+            prefer_grpc=settings.QDRANT_PREFER_GRPC,
+        )
     return _client
 
 
@@ -33,27 +55,44 @@ async def ensure_collection(dim: int = None) -> None:
     dim = dim or settings.EMBEDDING_DIM
     collections = await client.get_collections()
     names = [c.name for c in collections.collections]
+    quantize = settings.QDRANT_INT8_QUANTIZATION
     if settings.QDRANT_COLLECTION not in names:
         await client.create_collection(
             collection_name=settings.QDRANT_COLLECTION,
-            vectors_config=VectorParams(size=dim, distance=Distance.COSINE),
+            # float32 d'origine (rescoring, MMR) en RAM sauf choix explicite de stockage disque
+            vectors_config=VectorParams(
+                size=dim, distance=Distance.COSINE, on_disk=settings.QDRANT_VECTORS_ON_DISK,
+            ),
+            quantization_config=_INT8_QUANTIZATION if quantize else None,
         )
-        logger.info(f"Collection '{settings.QDRANT_COLLECTION}' créée (dim={dim})")
+        logger.info(f"Collection '{settings.QDRANT_COLLECTION}' créée (dim={dim}, int8={quantize})")
     else:
         logger.info(f"Collection '{settings.QDRANT_COLLECTION}' déjà existante (dim={dim})")
+        if quantize:
+            # Collection créée avant la quantification : index int8 construit en arrière-plan
+            info = await client.get_collection(settings.QDRANT_COLLECTION)
+            if info.config.quantization_config is None:
+                await client.update_collection(
+                    collection_name=settings.QDRANT_COLLECTION,
+                    quantization_config=_INT8_QUANTIZATION,
+                )
+                logger.info(f"Quantification int8 activée sur '{settings.QDRANT_COLLECTION}'")
     _collection_ready = True
 
 
 async def upsert_chunks(
     chunks: List[Dict[str, Any]],
-    embeddings: List[List[float]],
+    embeddings: np.ndarray,
     user_id: str,
     document_id: str,
 ) -> int:
     client = get_client()
+    # Identifiants UUID4 tirés d'un seul appel os.urandom pour tout le lot
+    # (et non un tirage CSPRNG par point)
+    raw_ids = os.urandom(16 * len(chunks))
     points = [
         PointStruct(
-            id=str(uuid.uuid4()),
+            id=str(uuid.UUID(bytes=raw_ids[16 * i:16 * i + 16], version=4)),
             vector=embedding,
             payload={
                 "document_id": document_id,
@@ -64,26 +103,27 @@ async def upsert_chunks(
                 "image_filenames": chunk.get("image_filenames", []),
             },
         )
-        for i, (chunk, embedding) in enumerate(zip(chunks, embeddings))
+        # Matrice float32 → listes une seule fois, à la frontière du client Qdrant
+        for i, (chunk, embedding) in enumerate(zip(chunks, embeddings.tolist()))
     ]
-    if points:
-        await client.upsert(collection_name=settings.QDRANT_COLLECTION, points=points)
-    return len(points)
+    # Fenêtres de _UPSERT_BATCH_SIZE points, indépendantes de la taille des lots
+    # d'embeddings : pas de requête géante qui bloque les autres écritures Qdrant
+    semaphore = asyncio.Semaphore(_UPSERT_CONCURRENCY)
 
+    async def _upsert_window(window: List[PointStruct]) -> None:
+        async with semaphore:
+            await client.upsert(collection_name=settings.QDRANT_COLLECTION, points=window)
 
-def _cosine_similarity(a: List[float], b: List[float]) -> float:
-    """Calcule la similarité cosinus entre deux vecteurs."""
-    dot = sum(x * y for x, y in zip(a, b))
-    norm_a = math.sqrt(sum(x * x for x in a))
-    norm_b = math.sqrt(sum(x * x for x in b))
-    if norm_a == 0 or norm_b == 0:
-        return 0.0
-    return dot / (norm_a * norm_b)
+    await asyncio.gather(*[
+        _upsert_window(points[i:i + _UPSERT_BATCH_SIZE])
+        for i in range(0, len(points), _UPSERT_BATCH_SIZE)
+    ])
+    return len(points)
 
 
 def _mmr_rerank(
     candidates: List[Dict[str, Any]],
-    query_embedding: List[float],
+    query_embedding: np.ndarray,
     top_k: int,
     lambda_mmr: float = 0.6,
 ) -> List[Dict[str, Any]]:
@@ -94,41 +134,51 @@ def _mmr_rerank(
 
     lambda_mmr : 1.0 = tri par pertinence pure, 0.0 = diversité pure.
     0.6 = bon équilibre pertinence/diversité.
+
+    Similarités cosinus entre candidats calculées en un seul produit matriciel,
+    puis sélection gloutonne par simple indexation de la matrice.
     """
     if not candidates:
         return []
 
+    n = len(candidates)
+    dim = max(len(c["vector"]) for c in candidates)
+    # Vecteur absent → ligne nulle : similarité 0 avec tous les autres
+    vectors = np.zeros((n, dim), dtype=np.float32)
+    for i, c in enumerate(candidates):
+        if len(c["vector"]):
+            vectors[i] = c["vector"]
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors /= np.where(norms == 0, 1, norms)
+    similarity = vectors @ vectors.T
+
     # On a déjà les scores de pertinence depuis Qdrant
-    selected = []
-    remaining = list(candidates)
+    relevance = np.array([c["score"] for c in candidates], dtype=np.float32)
+    max_sim = np.full(n, -np.inf, dtype=np.float32)
+    available = np.ones(n, dtype=bool)
+    selected: List[int] = []
 
-    while len(selected) < top_k and remaining:
+    while len(selected) < min(top_k, n):
         if not selected:
             # Premier chunk : prendre le plus pertinent
-            best = max(remaining, key=lambda c: c["score"])
+            best = int(np.argmax(relevance))
         else:
-            # Suivants : maximiser score MMR
-            def mmr_score(c):
-                relevance = c["score"]
-                # Similarité max avec les chunks déjà sélectionnés
-                max_sim = max(
-                    _cosine_similarity(c["vector"], s["vector"])
-                    for s in selected
-                )
-                return lambda_mmr * relevance - (1 - lambda_mmr) * max_sim
-
-            best = max(remaining, key=mmr_score)
-
+            # Suivants : maximiser score MMR (similarité max avec les chunks déjà sélectionnés)
+            mmr = lambda_mmr * relevance - (1 - lambda_mmr) * max_sim
+            mmr[~available] = -np.inf
+            best = int(np.argmax(mmr))
         selected.append(best)
-        remaining.remove(best)
+        available[best] = False
+        np.maximum(max_sim, similarity[best], out=max_sim)
 
     # Retrier les sélectionnés par score de pertinence pour l'affichage
-    selected.sort(key=lambda c: c["score"], reverse=True)
-    return selected
+    result = [candidates[i] for i in selected]
+    result.sort(key=lambda c: c["score"], reverse=True)
+    return result
 
 
 async def search_chunks(
-    query_embedding: List[float],
+    query_embedding: np.ndarray,
     user_id: str = None,
     top_k: int = 8,
     document_ids: Optional[List[str]] = None,
@@ -141,6 +191,35 @@ async def search_chunks(
     Si use_mmr=True, applique MMR pour diversifier les résultats
     (évite de retourner plusieurs chunks très similaires du même document).
     """
+    results = await search_chunks_batch(
+        [query_embedding],
+        user_id=user_id,
+        top_k=top_k,
+        document_ids=document_ids,
+        min_score=min_score,
+        use_mmr=use_mmr,
+        mmr_lambda=mmr_lambda,
+    )
+    return results[0]
+
+
+async def search_chunks_batch(
+    query_embeddings: List[np.ndarray],
+    user_id: str = None,
+    top_k: int = 8,
+    document_ids: Optional[List[str]] = None,
+    min_score: float = 0.0,
+    use_mmr: bool = True,
+    mmr_lambda: float = 0.6,
+) -> List[List[Dict[str, Any]]]:
+    """
+    Variante multi-requêtes de search_chunks (HyDE, reformulations…) : toutes les
+    recherches partent en un seul appel query_batch_points Qdrant (API Query) au lieu
+    d'un aller-retour par requête. Retourne une liste de résultats par vecteur, dans
+    le même ordre.
+    """
+    if not query_embeddings:
+        return []
     client = get_client()
     query_filter = None
     if document_ids:
@@ -151,16 +230,41 @@ async def search_chunks(
     # Récupérer plus de candidats pour MMR (3x top_k, min 20)
     fetch_k = max(top_k * 3, 20) if use_mmr else top_k
 
-    results = await client.search(
+    search_params = SearchParams(
+        hnsw_ef=settings.QDRANT_HNSW_EF,
+        # Parcours sur int8, puis 2x candidats rescorés avec les float32 d'origine
+        quantization=QuantizationSearchParams(rescore=True, oversampling=2.0)
+        if settings.QDRANT_INT8_QUANTIZATION else None,
+    )
+    requests = [
+        QueryRequest(
+            query=np.asarray(query_embedding, dtype=np.float32).tolist(),
+            filter=query_filter,
+            params=search_params,
+            limit=fetch_k,
+            score_threshold=min_score if min_score > 0 else None,
+            with_payload=True,
+            with_vector=use_mmr,  # nécessaire pour MMR
+        )
+        for query_embedding in query_embeddings
+    ]
+    responses = await client.query_batch_points(
         collection_name=settings.QDRANT_COLLECTION,
-        query_vector=query_embedding,
-        query_filter=query_filter,
-        limit=fetch_k,
-        score_threshold=min_score if min_score > 0 else None,
-        with_payload=True,
-        with_vectors=use_mmr,  # nécessaire pour MMR
+        requests=requests,
     )
+    return [
+        _to_chunks(response.points, query_embedding, top_k, use_mmr, mmr_lambda)
+        for response, query_embedding in zip(responses, query_embeddings)
+    ]
+
 
+def _to_chunks(
+    results: List[Any],
+    query_embedding: np.ndarray,
+    top_k: int,
+    use_mmr: bool,
+    mmr_lambda: float,
+) -> List[Dict[str, Any]]:
     candidates = [
         {
             "document_id": r.payload.get("document_id", ""),
@@ -169,7 +273,8 @@ async def search_chunks(
             "content": r.payload.get("content", ""),
             "score": r.score,
             "image_filenames": r.payload.get("image_filenames", []),
-            "vector": list(r.vector) if use_mmr and r.vector else [],
+            # float32 dès la réception : pas de liste de floats Python intermédiaire pour MMR
+            "vector": np.asarray(r.vector, dtype=np.float32) if use_mmr and r.vector else _NO_VECTOR,
         }
         for r in results
     ]
@@ -196,3 +301,25 @@ async def delete_document_chunks(document_id: str, user_id: str = None) -> None:
         ),
     )
     logger.info(f"Chunks supprimés pour document {document_id}")
+
+
+async def delete_documents_chunks(document_ids: List[str]) -> None:
+    """
+    Supprime les chunks de plusieurs documents : une requête filtrée (MatchAny) par
+    fenêtre de _DELETE_BATCH_SIZE ids, envoyées l'une après l'autre — et non un appel
+    Qdrant concurrent par document.
+    """
+    client = get_client()
+    for i in range(0, len(document_ids), _DELETE_BATCH_SIZE):
+        await client.delete(
+            collection_name=settings.QDRANT_COLLECTION,
+            points_selector=FilterSelector(
+                filter=Filter(must=[
+                    FieldCondition(
+                        key="document_id",
+                        match=MatchAny(any=document_ids[i:i + _DELETE_BATCH_SIZE]),
+                    ),
+                ])
+            ),
+        )
+    logger.info(f"Chunks supprimés pour {len(document_ids)} documents")
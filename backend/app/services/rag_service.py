@@ -1,12 +1,12 @@
 # -*- coding: utf-8 -*-
 import base64
-import json
 import logging
 import os
 import time
-from typing import AsyncGenerator, Any, Dict, List, Optional
+from typing import AsyncGenerator, Any, Dict, List, Optional, Tuple
 
 import httpx
+import orjson
 
 from app.config import settings
 from app.services.embedding_service import get_embedding
@@ -45,8 +45,18 @@ _vision_cache: Dict[str, Dict] = {}
 _VISION_CACHE_TTL = 300
 
 
-def _sse(data: dict) -> str:
-    return "data: " + json.dumps(data) + "\n\n"
+# Événement produit par stream_rag_response : (type, token, trame SSE encodée).
+# type ∈ {"token", "done", "meta"} — l'appelant accumule les tokens sans re-parser le JSON.
+RagEvent = Tuple[str, str, bytes]
+
+
+def _sse(data: dict) -> bytes:
+    # orjson produit directement des bytes UTF-8 : pas de str intermédiaire ni d'encode()
+    return b"data: " + orjson.dumps(data) + b"\n\n"
+
+
+def _meta(data: dict) -> RagEvent:
+    return "meta", "", _sse(data)
 
 
 def _build_prompt(question: str, chunks: List[Dict[str, Any]], context_max_chars: int = 12000) -> str:
@@ -168,11 +178,11 @@ async def stream_rag_response(
     context_max_chars: Optional[int] = 12000,
     system_prompt: Optional[str] = None,
     skip_rag: bool = False,  # NOUVEAU : si True, bypass total de Qdrant
-) -> AsyncGenerator[str, None]:
+) -> AsyncGenerator[RagEvent, None]:
 
     # Mode sans RAG — on envoie directement la question au LLM sans chercher dans Qdrant
     if skip_rag:
-        yield _sse({"type": "sources", "sources": []})
+        yield _meta({"type": "sources", "sources": []})
         prompt = question
         effective_prompt = system_prompt if system_prompt and system_prompt.strip() else RAG_SYSTEM_PROMPT
         messages = [{"role": "system", "content": effective_prompt}]
@@ -202,20 +212,20 @@ async def stream_rag_response(
                     if not line:
                         continue
                     try:
-                        data = json.loads(line)
+                        data = orjson.loads(line)
                         if data.get("done"):
-                            yield _sse({"type": "done"})
+                            yield "done", "", _sse({"type": "done"})
                             break
                         token = data.get("message", {}).get("content", "")
                         if token:
-                            yield _sse({"type": "token", "token": token})
-                    except json.JSONDecodeError:
+                            yield "token", token, _sse({"type": "token", "token": token})
+                    except orjson.JSONDecodeError:
                         continue
         except httpx.TimeoutException:
-            yield _sse({"type": "error", "error": f"Timeout: le modèle {model} met trop de temps à répondre"})
+            yield _meta({"type": "error", "error": f"Timeout: le modèle {model} met trop de temps à répondre"})
         except Exception as e:
             logger.error(f"Erreur streaming LLM (skip_rag): {e}")
-            yield _sse({"type": "error", "error": str(e)})
+            yield _meta({"type": "error", "error": str(e)})
         return
 
     # Mode normal avec RAG
@@ -231,7 +241,7 @@ async def stream_rag_response(
     try:
         query_embedding = await get_embedding(search_question, http_client)
     except Exception as e:
-        yield _sse({"type": "error", "error": f"Erreur embedding: {e}"})
+        yield _meta({"type": "error", "error": f"Erreur embedding: {e}"})
         return
 
     # 3. Recherche Qdrant
@@ -245,7 +255,7 @@ async def stream_rag_response(
             min_score=min_score if min_score is not None else 0.0,
         )
     except Exception as e:
-        yield _sse({"type": "error", "error": f"Erreur recherche: {e}"})
+        yield _meta({"type": "error", "error": f"Erreur recherche: {e}"})
         return
 
     # 4. Sources
@@ -260,7 +270,7 @@ async def stream_rag_response(
         }
         for c in chunks
     ]
-    yield _sse({"type": "sources", "sources": sources})
+    yield _meta({"type": "sources", "sources": sources})
 
     # 5. Vision
     supports_vision = await _check_vision_support(model, http_client)
@@ -338,20 +348,20 @@ async def stream_rag_response(
                 if not line:
                     continue
                 try:
-                    data = json.loads(line)
+                    data = orjson.loads(line)
                     if data.get("done"):
-                        yield _sse({"type": "done"})
+                        yield "done", "", _sse({"type": "done"})
                         break
                     token = data.get("message", {}).get("content", "")
                     if token:
-                        yield _sse({"type": "token", "token": token})
-                except json.JSONDecodeError:
+                        yield "token", token, _sse({"type": "token", "token": token})
+                except orjson.JSONDecodeError:
                     continue
     except httpx.TimeoutException:
-        yield _sse({"type": "error", "error": f"Timeout: le modèle {model} met trop de temps à répondre"})
+        yield _meta({"type": "error", "error": f"Timeout: le modèle {model} met trop de temps à répondre"})
     except Exception as e:
         logger.error(f"Erreur streaming LLM: {e}")
-        yield _sse({"type": "error", "error": str(e)})
+        yield _meta({"type": "error", "error": str(e)})
 
 
 async def list_available_models(http_client: httpx.AsyncClient) -> List[str]:
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""
+Cache en mémoire des utilisateurs authentifiés.
+
+get_current_user est appelé sur chaque requête authentifiée : sans cache, chaque
+appel coûte un SELECT sur users. Les instances mises en cache sont détachées de
+leur session (expunge, attributs déjà chargés), ce qui suffit aux
+routes qui n'utilisent que id / role / is_active / champs de UserOut.
+"""
+import logging
+import time
+from typing import Dict, Optional, Union
+from uuid import UUID
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.auth.service import get_user_by_id
+from app.models.database import User
+
+logger = logging.getLogger(__name__)
+
+_USER_CACHE_TTL = 60  # secondes
+_USER_CACHE_MAX = 10_000
+
+_user_cache: Dict[UUID, Dict] = {}
+
+
+async def get_cached_user(db: AsyncSession, user_id: UUID) -> Optional[User]:
+    now = time.monotonic()
+    cached = _user_cache.get(user_id)
+    if cached and (now - cached["ts"]) < _USER_CACHE_TTL:
+        return cached["user"]
+
+    user = await get_user_by_id(db, user_id)
+    if user is None:
+        _user_cache.pop(user_id, None)
+        return None
+
+    # Détachée de la session de cette requête : l'instance est partagée entre requêtes
+    db.expunge(user)
+    if len(_user_cache) >= _USER_CACHE_MAX:
+        # Éviction de l'entrée la plus ancienne (ordre d'insertion des dict)
+        _user_cache.pop(next(iter(_user_cache)), None)
+    _user_cache[user_id] = {"user": user, "ts": now}
+    return user
+
+
+def invalidate_user(user_id: Union[UUID, str]) -> None:
+    """À appeler après toute modification d'un utilisateur (rôle, désactivation…)."""
+    _user_cache.pop(user_id if isinstance(user_id, UUID) else UUID(user_id), None)
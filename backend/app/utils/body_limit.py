@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+"""
+Middleware ASGI de rejet anticipé des uploads trop volumineux.
+
+FastAPI lit et parse tout le corps multipart avant d'appeler la route : le contrôle de
+taille fait dans upload_document n'intervient qu'une fois le fichier entièrement reçu.
+Ici, un Content-Length déclaré au-delà de la limite est rejeté en 413 avant toute lecture
+du corps. Les envois sans Content-Length (chunked) restent contrôlés par la route.
+"""
+from typing import Iterable
+
+from fastapi.responses import ORJSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+# Marge pour les en-têtes et délimiteurs multipart autour du fichier
+_MULTIPART_OVERHEAD = 64 * 1024
+
+
+class ContentLengthLimitMiddleware:
+    def __init__(self, app: ASGIApp, max_body_size: int, paths: Iterable[str]) -> None:
+        self.app = app
+        self.max_content_length = max_body_size + _MULTIPART_OVERHEAD
+        self.paths = frozenset(paths)
+        self.detail = f"Fichier trop volumineux. Maximum : {max_body_size // 1024 // 1024} MB"
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http" and scope["path"] in self.paths:
+            for name, value in scope["headers"]:
+                if name == b"content-length":
+                    if value.isdigit() and int(value) > self.max_content_length:
+                        response = ORJSONResponse({"detail": self.detail}, status_code=413)
+                        await response(scope, receive, send)
+                        return
+                    break
+        await self.app(scope, receive, send)
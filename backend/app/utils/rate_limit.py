@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+"""
+Limiteur de débit partagé par toute l'application.
+
+Une seule instance (main.py + décorateurs des routers). Le stockage est configurable
+via RATE_LIMIT_STORAGE_URI : "memory://" par défaut (un compteur par processus),
+Redis en production pour que tous les workers partagent les mêmes compteurs.
+"""
+from slowapi import Limiter
+from slowapi.util import get_remote_address
+
+from app.config import settings
+
+limiter = Limiter(
+    key_func=get_remote_address,
+    storage_uri=settings.RATE_LIMIT_STORAGE_URI,
+    strategy="moving-window",
+)